@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """Caches final LLM answers keyed on the query embedding.
+
+    A new question is served from the cache when its cosine similarity to a
+    cached question is above the threshold, so paraphrases of the same
+    question ("cómo calibro la pantalla" / "como calibrar la pantalla") share
+    one answer. Entries expire after a TTL and the least recently used entry
+    is evicted once the cache is full.
+    """
+
+    def __init__(self, threshold: float = 0.92, ttl_seconds: float = 3600, max_entries: int = 500):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()  # key -> (vector, query, answer, created_at)
+        self._matrix = None            # Stacked vectors, rebuilt lazily after mutations
+        self._keys = []
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+        # Bumped by clear(); answers started before a clear are not stored
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_stores = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500")),
+        )
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _expire(self, now: float):
+        # Entries are kept in insertion/recency order, but TTL is based on
+        # creation time, so scan everything (the cache is small).
+        expired = [k for k, e in self._entries.items() if now - e[3] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _rebuild_matrix(self):
+        self._keys = list(self._entries.keys())
+        if self._keys:
+            self._matrix = np.vstack([self._entries[k][0] for k in self._keys])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    def _closest(self, vec: np.ndarray):
+        # Called with the lock held. Key of the closest question above the threshold, or None.
+        self._expire(time.time())
+        if not self._entries:
+            return None
+
+        if self._matrix is None:
+            self._rebuild_matrix()
+
+        scores = self._matrix @ vec
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self._keys[best]
+
+    def lookup(self, query_vector: List[float]) -> Optional[str]:
+        """Returns the cached answer for the closest question, or None."""
+        vec = self._normalize(query_vector)
+        with self._lock:
+            key = self._closest(vec)
+            if key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][2]
+
+    def contains(self, query_vector: List[float]) -> bool:
+        """Whether lookup() would hit, without counting it or touching recency."""
+        vec = self._normalize(query_vector)
+        with self._lock:
+            return self._closest(vec) is not None
+
+    def store(self, query: str, query_vector: List[float], answer: str, generation: Optional[int] = None):
+        """`generation` is the value read before retrieval; a clear() since then drops the answer."""
+        if not answer:
+            return
+        vec = self._normalize(query_vector)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_stores += 1
+                return
+            self._entries[self._next_key] = (vec, query, answer, time.time())
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def clear(self):
+        """Drops every cached answer (called whenever the index changes)."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_stores": self.stale_stores,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+            }
@@ -1,12 +1,17 @@
 import os
 import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from typing import Dict, Optional
 import bcrypt
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import or_, case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db
 from models import User
 from pydantic import BaseModel
 
@@ -23,7 +28,126 @@ class Token(BaseModel):
 
 import hashlib
 
+class UserCache:
+    """Per-worker TTL cache of authenticated users, keyed by token subject.
+
+    Saves the identity query on every authenticated request. Cached users
+    are detached ORM objects with their columns loaded; entries are dropped
+    explicitly via invalidate() whenever a user changes.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # subject -> (user, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subject: str):
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, subject: str, user):
+        with self._lock:
+            self._entries[subject] = (user, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *subjects: str):
+        with self._lock:
+            for subject in subjects:
+                self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class PasswordHashPool:
+    """Runs bcrypt off the event loop on a bounded thread pool.
+
+    bcrypt releases the GIL, so one thread per core gives real parallelism.
+    When more than `max_queue` operations are already waiting, new ones are
+    rejected with 429 instead of piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_pending = workers + max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._pending = 0  # queued + running; only touched from the event loop
+
+        self.completed = 0
+        self.rejected = 0
+        self.total_hash_seconds = 0.0
+        self.total_queue_seconds = 0.0
+        self.max_hash_seconds = 0.0
+        self.max_queue_seconds = 0.0
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Servidor ocupado, reintenta en unos segundos",
+                headers={"Retry-After": "1"},
+            )
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            return func(*args), started, time.perf_counter()
+
+        self._pending += 1
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self._pending -= 1
+
+        queue_seconds, hash_seconds = started - submitted, finished - started
+        self.completed += 1
+        self.total_queue_seconds += queue_seconds
+        self.total_hash_seconds += hash_seconds
+        self.max_queue_seconds = max(self.max_queue_seconds, queue_seconds)
+        self.max_hash_seconds = max(self.max_hash_seconds, hash_seconds)
+        return result
+
+    def stats(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_hash_ms": round(self.total_hash_seconds / done * 1000, 2),
+            "max_hash_ms": round(self.max_hash_seconds * 1000, 2),
+            "avg_queue_ms": round(self.total_queue_seconds / done * 1000, 2),
+            "max_queue_ms": round(self.max_queue_seconds * 1000, 2),
+        }
+
 class AuthService:
+    def __init__(self):
+        workers = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+        self.hash_pool = PasswordHashPool(
+            workers=workers,
+            max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", str(workers * 8))),
+        )
+        self.user_cache = UserCache(
+            ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "300")),
+            max_entries=int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000")),
+        )
+
     def _pre_hash(self, password: str) -> str:
         # Pre-hash with SHA-256 prevents bcrypt 72 byte limit error
         return hashlib.sha256(password.encode()).hexdigest()
@@ -41,17 +165,33 @@ class AuthService:
         hashed = bcrypt.hashpw(password_bytes, salt)
         return hashed.decode('utf-8')
 
-    def get_user(self, db: Session, username_or_email: str):
-        # Check by username
-        user = db.query(User).filter(User.username == username_or_email).first()
-        if user:
-            return user
-        # Check by email
-        user = db.query(User).filter(User.email == username_or_email).first()
-        return user
-
-    def create_user(self, db: Session, username: str, email: str, password: str):
-        hashed_pw = self.get_password_hash(password)
+    async def averify_password(self, plain_password, hashed_password):
+        return await self.hash_pool.run(self.verify_password, plain_password, hashed_password)
+
+    async def aget_password_hash(self, password):
+        return await self.hash_pool.run(self.get_password_hash, password)
+
+    async def get_user(self, db: AsyncSession, username_or_email: str):
+        # Single query; a username match wins over an email match
+        result = await db.execute(
+            select(User)
+            .where(or_(User.username == username_or_email, User.email == username_or_email))
+            .order_by(case((User.username == username_or_email, 0), else_=1))
+            .limit(1)
+        )
+        return result.scalars().first()
+
+    async def get_user_by_username(self, db: AsyncSession, username: str):
+        result = await db.execute(select(User).where(User.username == username).limit(1))
+        return result.scalars().first()
+
+    def invalidate_user(self, user: User):
+        """Must be called after any change to a user row."""
+        self.user_cache.invalidate(user.username)
+
+    async def create_user(self, db: AsyncSession, username: str, email: str, password: str, hashed_password: Optional[str] = None):
+        # Async callers hash on the pool first and pass hashed_password
+        hashed_pw = hashed_password or self.get_password_hash(password)
         new_user = User(
             username=username,
             email=email,
@@ -59,11 +199,12 @@ class AuthService:
         )
         try:
             db.add(new_user)
-            db.commit()
-            db.refresh(new_user)
+            await db.commit()
+            await db.refresh(new_user)
+            self.invalidate_user(new_user)
             return new_user
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             print(f"Error creating user: {e}")
             return None
 
@@ -76,7 +217,7 @@ class AuthService:
 
 auth_service = AuthService()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -90,7 +231,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = auth_service.get_user(db, username)
+    # Token subject is always the username (see create_access_token callers)
+    user = auth_service.user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await auth_service.get_user_by_username(db, username)
+        if user is None:
+            raise credentials_exception
+        # Detach so later commits in this request's session cannot expire the cached copy
+        db.expunge(user)
+        auth_service.user_cache.put(username, user)
     return user
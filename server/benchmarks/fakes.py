@@ -0,0 +1,102 @@
+import re
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words the fake LLM answers with. Sentences end with a period so the
+# speech endpoint splits them like real answers.
+_ANSWER_WORDS = (
+    "la pantalla táctil permite trabajar en grupo con actividades cortas y "
+    "visibles para toda la clase. conviene preparar los materiales antes. "
+    "los alumnos pueden pasar al frente y resolver los ejercicios en voz alta. "
+).split()
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings via feature hashing.
+
+    Texts that share words end up close together, so retrieval still ranks
+    sensibly. Same dimension as all-MiniLM-L6-v2 so index sizes are realistic.
+    `cost_ms` adds a fixed delay per text to mimic a real model on CPU.
+    """
+
+    def __init__(self, dim: int = 384, cost_ms: float = 0.0):
+        self.dim = dim
+        self.cost_ms = cost_ms
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cost_ms:
+            time.sleep(self.cost_ms * len(texts) / 1000)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeStreamingLLM(BaseChatModel):
+    """Chat model with a fixed time-to-first-token and tokens/sec.
+
+    The answer is the same for every prompt, so runs are comparable.
+    """
+
+    ttft_ms: float = 300.0
+    tokens_per_second: float = 30.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _tokens(self) -> List[str]:
+        return [_ANSWER_WORDS[i % len(_ANSWER_WORDS)] + " " for i in range(self.answer_tokens)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens()
+        time.sleep(self.ttft_ms / 1000 + self._token_delay() * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._tokens()
+        await asyncio.sleep(self.ttft_ms / 1000 + self._token_delay() * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens()):
+            time.sleep(self.ttft_ms / 1000 if i == 0 else self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens()):
+            await asyncio.sleep(self.ttft_ms / 1000 if i == 0 else self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def fake_synthesize(latency_ms: float):
+    """Replacement for TTSService.synthesize: fixed latency, ~1 KB of bytes per 10 chars."""
+    def synthesize(text: str) -> bytes:
+        time.sleep(latency_ms / 1000)
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return b"ID3" + digest * max(1, len(text) * 100 // len(digest) // 10)
+    return synthesize
@@ -0,0 +1,341 @@
+"""Offline benchmark suite: fake LLM, hashed embeddings and fake TTS, no network.
+
+Run from server/:
+
+    python -m benchmarks.run                                  # every suite
+    python -m benchmarks.run --suite retrieval --sizes 1000,20000
+    python -m benchmarks.run --compare benchmarks/results/<earlier>.json
+
+Each run writes a JSON report to benchmarks/results/.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import threading
+import subprocess
+
+from benchmarks.fakes import HashEmbeddings, FakeStreamingLLM, fake_synthesize
+from benchmarks.synthetic import make_corpus, write_pdf, random_text, random_question
+from benchmarks.stats import summarize, compare
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SERVER_DIR, "benchmarks", "results")
+SUITES = ("ingest", "retrieval", "api")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks for the API server.")
+    parser.add_argument("--suite", action="append", choices=SUITES, help="Suite to run (repeatable). Default: all.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Report path. Default: benchmarks/results/bench-<timestamp>.json")
+    parser.add_argument("--compare", help="Earlier report to compare against.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if a compared metric got >10%% worse.")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the temporary index/database directory.")
+    # Fake backends
+    parser.add_argument("--provider", default=os.getenv("AI_PROVIDER", "gemini"), help="Selects the LLM concurrency limit; the LLM itself is always fake.")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Fake LLM time to first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Simulated embedding cost per text.")
+    parser.add_argument("--tts-ms", type=float, default=200.0, help="Simulated TTS latency per clip.")
+    # Workload sizes
+    parser.add_argument("--ingest-files", type=int, default=20)
+    parser.add_argument("--sizes", default="1000,5000,20000", help="Corpus sizes (chunks) for the retrieval suite.")
+    parser.add_argument("--chunk-words", type=int, default=120)
+    parser.add_argument("--retrieval-queries", type=int, default=200)
+    parser.add_argument("--api-files", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per API scenario.")
+    parser.add_argument("--concurrency", type=int, default=10)
+    return parser.parse_args(argv)
+
+
+def _prepare_environment(workdir: str):
+    # Must run before any server module is imported: database.py connects at import time
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["TTS_CACHE_DIR"] = os.path.join(workdir, "tts_cache")
+    os.chdir(workdir)
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+
+
+def _install_fakes(args):
+    from rag_service import rag_service
+    from query_embedder import QueryEmbedder
+    from tts_service import tts_service
+
+    # _load_models() skips loading when embeddings are already set
+    rag_service.provider = args.provider
+    rag_service.embeddings = HashEmbeddings(cost_ms=args.embed_ms)
+    rag_service.query_embedder = QueryEmbedder.from_env(rag_service.embeddings)
+    rag_service.set_llms({args.provider: FakeStreamingLLM(ttft_ms=args.ttft_ms, tokens_per_second=args.tokens_per_second, answer_tokens=args.answer_tokens)})
+    tts_service.synthesize = fake_synthesize(args.tts_ms)
+    return rag_service
+
+
+# --- INGESTION ---
+
+def bench_ingest(rag_service, workdir: str, args) -> dict:
+    corpus = os.path.join(workdir, "ingest_corpus")
+    paths = make_corpus(corpus, args.ingest_files, seed=args.seed)
+    rag_service.index_path = os.path.join(workdir, "ingest_index")
+
+    results = {"files": args.ingest_files}
+
+    def timed(label):
+        start = time.perf_counter()
+        rag_service.ingest_pdfs(corpus)
+        results[label] = {"seconds": round(time.perf_counter() - start, 3)}
+
+    timed("cold")
+    timed("unchanged")
+    write_pdf(paths[0], [random_text(random.Random(args.seed + 1000), 600) for _ in range(4)])
+    timed("one_file_changed")
+    results["chunks"] = rag_service.vector_store.index.ntotal
+    return results
+
+
+# --- RETRIEVAL ---
+
+def bench_retrieval(rag_service, workdir: str, args) -> list:
+    from langchain_community.vectorstores import FAISS
+    from bm25_index import BM25Index
+    from compact_store import save_compact_store, load_compact_store
+    from hybrid_retrieval import HybridRetriever
+
+    rng = random.Random(args.seed)
+    embeddings = rag_service.embeddings
+    queries = [random_question(rng) for _ in range(args.retrieval_queries)]
+    query_vectors = embeddings.embed_documents(queries)
+
+    rows = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        texts = [random_text(rng, args.chunk_words) for _ in range(size)]
+        ids = [f"bench-{i}" for i in range(size)]
+        store = FAISS.from_embeddings(list(zip(texts, embeddings.embed_documents(texts))), embeddings, metadatas=[{"source": "bench"}] * size, ids=ids)
+        # Serve from the memory-mapped format, like production
+        path = os.path.join(workdir, f"retrieval_{size}")
+        save_compact_store(store, path)
+        store = load_compact_store(path, embeddings)
+        lexical_index = BM25Index()
+        lexical_index.add(ids, texts)
+
+        for mode, lexical in (("dense", None), ("hybrid", lexical_index)):
+            retriever = HybridRetriever(vector_store=store, lexical_index=lexical)
+            latencies = []
+            for query, vector in zip(queries, query_vectors):
+                start = time.perf_counter()
+                retriever.retrieve(query, vector)
+                latencies.append(time.perf_counter() - start)
+            rows.append({"label": f"{mode}@{size}", "mode": mode, "chunks": size, **summarize(latencies)})
+    return rows
+
+
+# --- END-TO-END API ---
+
+async def _timed_request(client, method: str, url: str, **kwargs):
+    """Returns (total seconds, seconds to first body byte, response headers)."""
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream(method, url, **kwargs) as response:
+        async for _ in response.aiter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url}: HTTP {response.status_code}")
+    total = time.perf_counter() - start
+    return total, first_byte if first_byte is not None else total, response.headers
+
+
+async def _run_load(concurrency: int, calls) -> dict:
+    """Runs the request coroutines with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_bytes = [], []
+    errors = 0
+
+    async def one(call):
+        nonlocal errors
+        async with semaphore:
+            try:
+                total, first_byte, _ = await call()
+                latencies.append(total)
+                first_bytes.append(first_byte)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  first error: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(call) for call in calls))
+    return summarize(latencies, time.perf_counter() - start, errors, first_bytes)
+
+
+async def _api_load(base_url: str, args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        deadline = time.monotonic() + 300
+        while (await client.get("/ready")).status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Server did not become ready")
+            await asyncio.sleep(0.2)
+
+        response = await client.post("/api/auth/register", json={"username": "bench", "email": "bench@example.com", "password": "bench-password"})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        results = {}
+
+        print("  chat_stream...")
+        questions = [random_question(rng) for _ in range(args.requests)]
+        results["chat_stream"] = await _run_load(args.concurrency, [
+            lambda q=q: _timed_request(client, "POST", "/api/chat/stream", json={"message": q}, headers=headers)
+            for q in questions
+        ])
+
+        print("  tts...")
+        # Half as many distinct texts as requests: a mix of cache misses and hits
+        texts = [random_text(rng, 12) for _ in range(max(1, args.requests // 2))]
+        results["tts"] = await _run_load(args.concurrency, [
+            lambda t=rng.choice(texts): _timed_request(client, "POST", "/api/tts", json={"text": t})
+            for _ in range(args.requests)
+        ])
+
+        print("  community...")
+        results["community_create"] = await _run_load(args.concurrency, [
+            lambda i=i: _timed_request(client, "POST", "/api/community/posts", json={"content": f"Post de prueba {i}"}, headers=headers)
+            for i in range(args.requests)
+        ])
+        _, _, first_page = await _timed_request(client, "GET", "/api/community/posts")
+        cursor = first_page.get("x-next-cursor")
+        results["community_feed"] = await _run_load(args.concurrency, [
+            lambda page=rng.choice([None, cursor]): _timed_request(client, "GET", "/api/community/posts", params={"cursor": page} if page else {})
+            for _ in range(args.requests)
+        ])
+        post_ids = list(range(1, args.requests + 1))
+        results["community_like"] = await _run_load(args.concurrency, [
+            lambda post_id=rng.choice(post_ids): _timed_request(client, "POST", f"/api/community/posts/{post_id}/like", headers=headers)
+            for _ in range(args.requests)
+        ])
+    return results
+
+
+def bench_api(rag_service, workdir: str, args) -> dict:
+    import uvicorn
+
+    corpus = os.path.join(workdir, "api_corpus")
+    make_corpus(corpus, args.api_files, seed=args.seed + 1)
+    os.environ["DATA_DIR"] = corpus
+    rag_service.index_path = os.path.join(workdir, "api_index")
+    rag_service.ready = False
+
+    import main
+    from tts_service import tts_service
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    try:
+        results = asyncio.run(_api_load(f"http://127.0.0.1:{port}", args))
+    finally:
+        server.should_exit = True
+        thread.join()
+    results["caches"] = {
+        "answer_cache": rag_service.answer_cache.stats(),
+        "tts_cache": tts_service.cache.stats(),
+    }
+    return results
+
+
+# --- REPORT ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _print_summary(results: dict):
+    print("\n=== Results ===")
+    for row in results.get("retrieval", []):
+        print(f"retrieval {row['label']:>14}: p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms")
+    for name, summary in results.get("api", {}).items():
+        if "p50_ms" in summary:
+            print(f"api {name:>18}: p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms  "
+                  f"ttfb p50 {summary.get('ttfb_p50_ms')} ms  {summary.get('throughput_rps')} req/s  errors {summary['errors']}")
+    ingest = results.get("ingest")
+    if ingest:
+        print(f"ingest {ingest['files']} files / {ingest['chunks']} chunks: cold {ingest['cold']['seconds']} s, "
+              f"unchanged {ingest['unchanged']['seconds']} s, one changed {ingest['one_file_changed']['seconds']} s")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    suites = args.suite or list(SUITES)
+    started_at = datetime.datetime.now()
+
+    workdir = tempfile.mkdtemp(prefix="tomi-bench-")
+    results = {}
+    try:
+        _prepare_environment(workdir)
+        rag_service = _install_fakes(args)
+        if "ingest" in suites:
+            print("Running ingest suite...")
+            results["ingest"] = bench_ingest(rag_service, workdir, args)
+        if "retrieval" in suites:
+            print("Running retrieval suite...")
+            results["retrieval"] = bench_retrieval(rag_service, workdir, args)
+        if "api" in suites:
+            print("Running API suite...")
+            results["api"] = bench_api(rag_service, workdir, args)
+    finally:
+        os.chdir(SERVER_DIR)
+        if args.keep_workdir:
+            print(f"Work directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"bench-{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    _print_summary(results)
+    print(f"\nReport written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            lines = compare(json.load(f), report)
+        print(f"\n=== Compared with {args.compare} ===")
+        print("\n".join(lines) or "No common metrics.")
+        if args.fail_on_regression and any(line.endswith("REGRESSION") for line in lines):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Metrics compared between runs, and whether lower is better
+COMPARED_METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "ttfb_p50_ms": True,
+    "ttfb_p95_ms": True,
+    "throughput_rps": False,
+    "seconds": True,
+}
+
+
+def summarize(latencies: List[float], wall_seconds: Optional[float] = None, errors: int = 0, first_byte: Optional[List[float]] = None) -> Dict:
+    """Latency percentiles in ms (inputs in seconds) and throughput over the wall time."""
+    result = {"count": len(latencies), "errors": errors}
+    if latencies:
+        values = np.array(latencies) * 1000
+        result.update({
+            "p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "p99_ms": round(float(np.percentile(values, 99)), 2),
+            "mean_ms": round(float(values.mean()), 2),
+            "max_ms": round(float(values.max()), 2),
+        })
+    if first_byte:
+        values = np.array(first_byte) * 1000
+        result["ttfb_p50_ms"] = round(float(np.percentile(values, 50)), 2)
+        result["ttfb_p95_ms"] = round(float(np.percentile(values, 95)), 2)
+    if wall_seconds:
+        result["throughput_rps"] = round(len(latencies) / wall_seconds, 2)
+    return result
+
+
+def _flatten(data, prefix="") -> Dict[str, float]:
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, list):
+        for item in data:
+            label = item.get("label") if isinstance(item, dict) else None
+            if label is not None:
+                flat.update(_flatten(item, f"{prefix}[{label}]"))
+    elif isinstance(data, (int, float)):
+        flat[prefix] = data
+    return flat
+
+
+def compare(old: Dict, new: Dict, threshold: float = 0.10) -> List[str]:
+    """Lines describing metric changes between two result files; regressions above `threshold` are flagged."""
+    old_flat, new_flat = _flatten(old.get("results", {})), _flatten(new.get("results", {}))
+    lines = []
+    for key in sorted(set(old_flat) & set(new_flat)):
+        metric = key.rsplit(".", 1)[-1]
+        if metric not in COMPARED_METRICS or not old_flat[key]:
+            continue
+        change = (new_flat[key] - old_flat[key]) / old_flat[key]
+        worse = change > 0 if COMPARED_METRICS[metric] else change < 0
+        flag = "  REGRESSION" if worse and abs(change) > threshold else ""
+        lines.append(f"{key}: {old_flat[key]} -> {new_flat[key]} ({change:+.1%}){flag}")
+    return lines
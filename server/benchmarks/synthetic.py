@@ -0,0 +1,87 @@
+import os
+import random
+from typing import List
+
+# ASCII only: the PDFs use a standard Type1 font without an encoding table
+VOCABULARY = (
+    "pantalla tactil docente alumno aula actividad clase grupo lectura escritura "
+    "matematica ciencias juego pizarra digital imagen video audio proyecto evaluacion "
+    "planificacion secuencia recurso herramienta aplicacion navegador archivo carpeta "
+    "conexion red usuario contrasena calibracion brillo volumen cable enchufe control "
+    "dibujo color forma numero fraccion mapa historia geografia musica arte ingles "
+    "consigna tarea trabajo colaborativo inclusion accesibilidad tiempo turno ronda "
+    "pregunta respuesta ejemplo practica repaso diagnostico retroalimentacion rubrica"
+).split()
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def random_question(rng: random.Random) -> str:
+    return f"Como uso la {rng.choice(VOCABULARY)} para una {rng.choice(VOCABULARY)} de {rng.choice(VOCABULARY)}?"
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _wrap(text: str, width: int = 90) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def write_pdf(path: str, pages: List[str]):
+    """Writes a minimal text PDF (one Helvetica text block per page) that PyPDFLoader can read."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for text in pages:
+        lines = _wrap(text)[:60]
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % ref for ref in page_refs)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_corpus(directory: str, files: int, pages_per_file: int = 4, words_per_page: int = 600, seed: int = 0) -> List[str]:
+    """Creates `files` synthetic PDFs in `directory`. Same seed, same bytes."""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f"manual_{i:04d}.pdf")
+        write_pdf(path, [random_text(rng, words_per_page) for _ in range(pages_per_file)])
+        paths.append(path)
+    return paths
@@ -0,0 +1,177 @@
+import os
+import re
+import math
+import unicodedata
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+BM25_FILENAME = "bm25.npz"
+
+# Common Spanish function words; they carry no signal for retrieval
+SPANISH_STOPWORDS = {
+    "a", "al", "algo", "como", "con", "cual", "cuando", "de", "del", "desde", "donde", "el", "ella",
+    "ellos", "en", "entre", "era", "es", "esa", "ese", "eso", "esta", "este", "esto", "fue", "ha",
+    "hay", "la", "las", "le", "les", "lo", "los", "mas", "me", "mi", "muy", "no", "nos", "o", "para",
+    "pero", "por", "que", "se", "si", "sin", "sobre", "son", "su", "sus", "tambien", "te", "tu",
+    "un", "una", "uno", "unos", "unas", "y", "ya", "yo",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9ñ]+")
+
+
+def fold_accents(text: str) -> str:
+    """Lowercases and strips accents ("Configuración" -> "configuracion"), keeping ñ."""
+    text = text.lower().replace("ñ", "\0")
+    folded = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return folded.replace("\0", "ñ")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(fold_accents(text)) if len(t) > 1 and t not in SPANISH_STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index with BM25 scoring over the chunks of the vector store.
+
+    Postings are compact typed arrays (doc numbers as uint32, term
+    frequencies as uint16) keyed by term. Documents are identified by the same
+    ids as the FAISS docstore so both rankings can be fused. Removals are
+    tombstoned and compacted away on save.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []           # doc number -> docstore id
+        self.doc_lengths = array("I")
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_numbers: Dict[str, int] = {}
+        self._deleted = set()
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids) - len(self._deleted)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]):
+        for doc_id, text in zip(ids, texts):
+            if doc_id in self._doc_numbers:
+                continue
+            tokens = tokenize(text)
+            number = len(self.doc_ids)
+            self.doc_ids.append(doc_id)
+            self.doc_lengths.append(len(tokens))
+            self._doc_numbers[doc_id] = number
+            self._total_length += len(tokens)
+
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, tf in counts.items():
+                docs, tfs = self.postings.setdefault(term, (array("I"), array("H")))
+                docs.append(number)
+                tfs.append(min(tf, 65535))
+
+    def remove(self, ids: Iterable[str]):
+        for doc_id in ids:
+            number = self._doc_numbers.pop(doc_id, None)
+            if number is not None:
+                self._deleted.add(number)
+                self._total_length -= self.doc_lengths[number]
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """Returns up to k (doc_id, score) pairs, best first."""
+        live_docs = len(self)
+        if live_docs == 0:
+            return []
+        avg_length = max(self._total_length / live_docs, 1.0)
+        lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32).astype(np.float32)
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            docs = np.frombuffer(entry[0], dtype=np.uint32)
+            tfs = np.frombuffer(entry[1], dtype=np.uint16).astype(np.float32)
+            df = len(docs)
+            idf = math.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        if self._deleted:
+            scores[list(self._deleted)] = 0
+        candidates = np.nonzero(scores)[0]
+        if len(candidates) == 0:
+            return []
+        top = candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+    # --- PERSISTENCE ---
+
+    def _compact(self):
+        """Rebuilds doc numbering without tombstoned documents."""
+        if not self._deleted:
+            return
+        remap = {}
+        doc_ids, lengths = [], array("I")
+        for number, doc_id in enumerate(self.doc_ids):
+            if number not in self._deleted:
+                remap[number] = len(doc_ids)
+                doc_ids.append(doc_id)
+                lengths.append(self.doc_lengths[number])
+
+        postings = {}
+        for term, (docs, tfs) in self.postings.items():
+            new_docs, new_tfs = array("I"), array("H")
+            for number, tf in zip(docs, tfs):
+                if number in remap:
+                    new_docs.append(remap[number])
+                    new_tfs.append(tf)
+            if new_docs:
+                postings[term] = (new_docs, new_tfs)
+
+        self.doc_ids, self.doc_lengths, self.postings = doc_ids, lengths, postings
+        self._doc_numbers = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        self._deleted = set()
+
+    def save(self, path: str):
+        self._compact()
+        terms = sorted(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        docs = np.concatenate([np.frombuffer(self.postings[t][0], dtype=np.uint32) for t in terms]) if terms else np.zeros(0, np.uint32)
+        tfs = np.concatenate([np.frombuffer(self.postings[t][1], dtype=np.uint16) for t in terms]) if terms else np.zeros(0, np.uint16)
+
+        file_path = os.path.join(path, BM25_FILENAME)
+        with open(file_path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                terms=np.array(terms, dtype=str),
+                offsets=offsets,
+                docs=docs,
+                tfs=tfs,
+                doc_ids=np.array(self.doc_ids, dtype=str),
+                doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.uint32),
+            )
+        os.replace(file_path + ".tmp", file_path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        with np.load(os.path.join(path, BM25_FILENAME)) as data:
+            offsets, docs, tfs = data["offsets"], data["docs"], data["tfs"]
+            for i, term in enumerate(data["terms"].tolist()):
+                start, end = offsets[i], offsets[i + 1]
+                index.postings[term] = (array("I", docs[start:end].tobytes()), array("H", tfs[start:end].tobytes()))
+            index.doc_ids = data["doc_ids"].tolist()
+            index.doc_lengths = array("I", data["doc_lengths"].astype(np.uint32).tobytes())
+        index._doc_numbers = {doc_id: i for i, doc_id in enumerate(index.doc_ids)}
+        index._total_length = int(sum(index.doc_lengths))
+        return index
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, BM25_FILENAME))
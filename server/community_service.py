@@ -1,14 +1,114 @@
+import os
 import time
-from typing import List, Dict
-from sqlalchemy.orm import Session, joinedload
+import json
+import base64
+import hashlib
+import datetime
+import threading
+from typing import List, Dict, Optional, Tuple
+from sqlalchemy import or_, and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Post, User
+from database import SessionLocal
+from like_counter import LikeCounter
+
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", "20"))
+FEED_MAX_PAGE_SIZE = int(os.getenv("FEED_MAX_PAGE_SIZE", "100"))
+# Bounds staleness across workers (each worker only sees its own invalidations)
+FEED_CACHE_TTL_SECONDS = float(os.getenv("FEED_CACHE_TTL_SECONDS", "5"))
+
+def encode_cursor(timestamp: datetime.datetime, post_id: int) -> str:
+    raw = f"{timestamp.isoformat()}|{post_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        timestamp, post_id = raw.rsplit("|", 1)
+        return datetime.datetime.fromisoformat(timestamp), int(post_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+class FeedPage:
+    """Serialized feed page: JSON body, its ETag and the cursor of the next page."""
+
+    def __init__(self, body: bytes, next_cursor: Optional[str]):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.next_cursor = next_cursor
+
+def _post_dict(row, username=None) -> dict:
+    return {
+        "id": row.id,
+        "content": row.content,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "likes": row.likes,
+        "author_id": row.author_id,
+        "author": {"id": row.author_id, "username": username} if row.author_id else None,
+    }
 
 class CommunityService:
-    def get_posts(self, db: Session) -> List[Post]:
-        # Return posts sorted by timestamp descending, eager loading author
-        return db.query(Post).options(joinedload(Post.author)).order_by(Post.timestamp.desc()).all()
+    def __init__(self):
+        # First page of the feed (the one the frontend polls), per worker.
+        # Cached as rows; pending like deltas are merged in when serving.
+        self._first_page: Optional[Tuple[List[dict], Optional[str]]] = None
+        self._first_page_expires = 0.0
+        self._first_page_version = 0  # bumped by every invalidation
+        self._lock = threading.Lock()
+
+        # Likes are counted in memory and flushed to Postgres in batches
+        self.like_counter = LikeCounter.from_env(SessionLocal)
+        # Cached rows hold counts read before the flush; the flushed deltas
+        # are no longer pending, so the cached page must be re-read
+        self.like_counter.on_flush = self.invalidate_feed
+
+    async def get_feed_page(self, db: AsyncSession, limit: int = FEED_PAGE_SIZE, cursor: Optional[str] = None) -> FeedPage:
+        """Keyset-paginated feed, newest first, ordered by (timestamp, id)."""
+        limit = max(1, min(limit, FEED_MAX_PAGE_SIZE))
+        cacheable = cursor is None and limit == FEED_PAGE_SIZE
+        if cacheable:
+            with self._lock:
+                if self._first_page is not None and time.monotonic() < self._first_page_expires:
+                    return self._render_page(*self._first_page)
+                version = self._first_page_version
 
-    def create_post(self, db: Session, author_id: int, content: str) -> Post:
+        # Lean projection: only the columns the feed shows, no ORM objects
+        query = (
+            select(Post.id, Post.content, Post.timestamp, Post.likes, Post.author_id, User.username)
+            .outerjoin(User, Post.author_id == User.id)
+        )
+        if cursor is not None:
+            timestamp, post_id = decode_cursor(cursor)
+            query = query.where(or_(Post.timestamp < timestamp, and_(Post.timestamp == timestamp, Post.id < post_id)))
+        result = await db.execute(query.order_by(Post.timestamp.desc(), Post.id.desc()).limit(limit + 1))
+        rows = result.all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        items = [_post_dict(row, row.username) for row in rows]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None
+
+        if cacheable:
+            with self._lock:
+                # Skip the store if a flush or new post landed during the read
+                if self._first_page_version == version:
+                    self._first_page = (items, next_cursor)
+                    self._first_page_expires = time.monotonic() + FEED_CACHE_TTL_SECONDS
+        return self._render_page(items, next_cursor)
+
+    def _render_page(self, items: List[dict], next_cursor: Optional[str]) -> FeedPage:
+        pending = self.like_counter.pending_snapshot()
+        if pending:
+            items = [{**item, "likes": item["likes"] + pending[item["id"]]} if item["id"] in pending else item for item in items]
+        return FeedPage(json.dumps(items, ensure_ascii=False).encode("utf-8"), next_cursor)
+
+    def invalidate_feed(self):
+        with self._lock:
+            self._first_page = None
+            self._first_page_version += 1
+
+    async def create_post(self, db: AsyncSession, author_id: int, content: str) -> Post:
         new_post = Post(
             author_id=author_id,
             content=content,
@@ -16,22 +116,28 @@ class CommunityService:
         )
         try:
             db.add(new_post)
-            db.commit()
-            db.refresh(new_post)
+            await db.commit()
+            await db.refresh(new_post)
+            self.invalidate_feed()
             return new_post
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             print(f"Error creating post: {e}")
             return None
 
-    def like_post(self, db: Session, post_id: int) -> Post:
-        post = db.query(Post).filter(Post.id == post_id).first()
-        if post:
-            post.likes += 1
-            db.commit()
-            db.refresh(post)
-            return post
-        return None
+    async def like_post(self, db: AsyncSession, post_id: int) -> Optional[dict]:
+        # One plain read (no row lock); the increment itself is write-behind
+        result = await db.execute(
+            select(Post.id, Post.content, Post.timestamp, Post.likes, Post.author_id).where(Post.id == post_id)
+        )
+        row = result.first()
+        if row is None:
+            return None
+        self.like_counter.increment(post_id)
+        post = _post_dict(row)
+        post.pop("author")
+        post["likes"] = row.likes + self.like_counter.pending(post_id)
+        return post
 
 # Singleton instance
 community_service = CommunityService()
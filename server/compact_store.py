@@ -0,0 +1,213 @@
+import os
+import json
+import mmap
+from collections.abc import MutableMapping
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain.docstore.document import Document
+
+# On-disk layout of a compact index directory:
+#   index.faiss               FAISS vectors, memory-mapped read-only when serving
+#   chunks_<column>.bin       concatenated UTF-8 values (text, meta JSON, id)
+#   chunks_<column>.idx.npy   int64 offsets into the .bin file (n + 1 entries)
+#   chunks_id.order.npy       positions sorted by id, for O(log n) id lookups
+# Every worker maps the same files, so the OS page cache is shared and nothing
+# is deserialized up front.
+COLUMNS = ("text", "meta", "id")
+# faiss and the LangChain FAISS wrapper are imported where an index is read or
+# written, so the existence checks below stay cheap to import
+
+
+def has_compact_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "index.faiss")) and os.path.exists(os.path.join(path, "chunks_id.order.npy"))
+
+
+def has_pickle_index(path: str) -> bool:
+    return os.path.exists(os.path.join(path, "index.faiss")) and os.path.exists(os.path.join(path, "index.pkl"))
+
+
+class ChunkColumn:
+    """Read-only, offset-indexed column of UTF-8 values backed by mmap."""
+
+    def __init__(self, path: str, name: str):
+        self.offsets = np.load(os.path.join(path, f"chunks_{name}.idx.npy"), mmap_mode="r")
+        data_path = os.path.join(path, f"chunks_{name}.bin")
+        self._file = open(data_path, "rb")
+        size = os.path.getsize(data_path)
+        # mmap cannot map an empty file
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, position: int) -> str:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return self._data[start:end].decode("utf-8")
+
+    @staticmethod
+    def write(path: str, name: str, values: List[str]):
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        data_path = os.path.join(path, f"chunks_{name}.bin")
+        with open(data_path + ".tmp", "wb") as f:
+            for i, value in enumerate(values):
+                encoded = value.encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        # np.save appends ".npy" unless the name already ends with it
+        idx_path = os.path.join(path, f"chunks_{name}.idx.npy")
+        with open(idx_path + ".tmp", "wb") as f:
+            np.save(f, offsets)
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(idx_path + ".tmp", idx_path)
+
+
+class CompactDocstore(Docstore, AddableMixin):
+    """Docstore that reads chunk text and metadata lazily from ChunkColumns.
+
+    Documents added or deleted after loading are kept in a small in-memory
+    overlay until the store is saved again.
+    """
+
+    def __init__(self, path: str):
+        self._text = ChunkColumn(path, "text")
+        self._meta = ChunkColumn(path, "meta")
+        self._ids = ChunkColumn(path, "id")
+        self._order = np.load(os.path.join(path, "chunks_id.order.npy"), mmap_mode="r")
+        self._added: Dict[str, Document] = {}
+        self._deleted = set()
+
+    def _position(self, doc_id: str) -> Optional[int]:
+        lo, hi = 0, len(self._order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._ids.get(int(self._order[mid])) < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._order):
+            position = int(self._order[lo])
+            if self._ids.get(position) == doc_id:
+                return position
+        return None
+
+    def _document_at(self, position: int) -> Document:
+        return Document(page_content=self._text.get(position), metadata=json.loads(self._meta.get(position)))
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return f"ID {search} not found."
+        position = self._position(search)
+        if position is None:
+            return f"ID {search} not found."
+        return self._document_at(position)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [doc_id for doc_id in texts if not isinstance(self.search(doc_id), str)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {set(overlapping)}")
+        for doc_id, doc in texts.items():
+            self._deleted.discard(doc_id)
+            self._added[doc_id] = doc
+
+    def delete(self, ids: List) -> None:
+        for doc_id in ids:
+            if doc_id in self._added:
+                del self._added[doc_id]
+            else:
+                self._deleted.add(doc_id)
+
+
+class LazyIndexToId(MutableMapping):
+    """FAISS position -> docstore id, read from the id column on demand.
+
+    Positions past the saved ones (newly added chunks) live in an overlay dict.
+    """
+
+    def __init__(self, ids: ChunkColumn):
+        self._ids = ids
+        self._base = len(ids)
+        self._extra: Dict[int, str] = {}
+
+    def __getitem__(self, position: int) -> str:
+        position = int(position)
+        if 0 <= position < self._base:
+            return self._ids.get(position)
+        return self._extra[position]
+
+    def __setitem__(self, position: int, doc_id: str):
+        if 0 <= int(position) < self._base:
+            raise ValueError("Saved positions are read-only; save and reload the store instead.")
+        self._extra[int(position)] = doc_id
+
+    def __delitem__(self, position: int):
+        raise ValueError("Saved positions are read-only; use FAISS.delete instead.")
+
+    def __iter__(self):
+        yield from range(self._base)
+        yield from self._extra
+
+    def __len__(self) -> int:
+        return self._base + len(self._extra)
+
+
+def load_compact_store(path: str, embeddings, writable: bool = False):
+    """Opens a compact index directory as a LangChain FAISS store.
+
+    Read-only stores memory-map the vectors. Writable stores (used while
+    ingesting) read the vectors into memory so they can be added to/removed.
+    """
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    index_file = os.path.join(path, "index.faiss")
+    if writable:
+        index = faiss.read_index(index_file)
+    else:
+        # IO_FLAG_MMAP_IFC also maps flat indexes; older faiss builds only have IO_FLAG_MMAP
+        index = faiss.read_index(index_file, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY)
+    docstore = CompactDocstore(path)
+    return FAISS(embeddings, index, docstore, LazyIndexToId(docstore._ids))
+
+
+def save_compact_store(vector_store, path: str):
+    """Writes a FAISS store (any docstore) in the compact format."""
+    import faiss
+
+    os.makedirs(path, exist_ok=True)
+    mapping = vector_store.index_to_docstore_id
+    ids = [mapping[i] for i in range(len(mapping))]
+    texts, metas = [], []
+    for doc_id in ids:
+        doc = vector_store.docstore.search(doc_id)
+        if not isinstance(doc, Document):
+            raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+        texts.append(doc.page_content)
+        metas.append(json.dumps(doc.metadata, ensure_ascii=False))
+
+    index_file = os.path.join(path, "index.faiss")
+    faiss.write_index(vector_store.index, index_file + ".tmp")
+
+    ChunkColumn.write(path, "text", texts)
+    ChunkColumn.write(path, "meta", metas)
+    ChunkColumn.write(path, "id", ids)
+    order = np.array(sorted(range(len(ids)), key=lambda i: ids[i]), dtype=np.int64)
+    order_path = os.path.join(path, "chunks_id.order.npy")
+    with open(order_path + ".tmp", "wb") as f:
+        np.save(f, order)
+
+    os.replace(index_file + ".tmp", index_file)
+    os.replace(order_path + ".tmp", order_path)
+
+
+def convert_pickle_store(path: str, embeddings):
+    """One-time conversion of a FAISS.save_local() directory to the compact format."""
+    from langchain_community.vectorstores import FAISS
+
+    print(f"Converting pickled index at {path} to the compact format...")
+    legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    save_compact_store(legacy, path)
+    os.remove(os.path.join(path, "index.pkl"))
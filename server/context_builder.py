@@ -0,0 +1,120 @@
+import os
+import re
+import math
+from typing import List, Set
+
+from langchain.docstore.document import Document
+
+from bm25_index import tokenize
+
+# Prompt context budget per provider, in (estimated) tokens. llama3.2 on a
+# CPU-only box spends most of its time evaluating the prompt, and Ollama's
+# default context window is 2048 tokens; cloud models take much more.
+DEFAULT_CONTEXT_TOKENS = {
+    "ollama": 1000,
+    "gemini": 4000,
+    "deepseek": 4000,
+}
+# Chunks retrieved before deduplication and trimming
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "6"))
+# Chunks whose term sets overlap this much (Jaccard) count as duplicates
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Sentences kept on each side of a sentence that matches the query
+CONTEXT_NEIGHBOR_SENTENCES = int(os.getenv("CONTEXT_NEIGHBOR_SENTENCES", "1"))
+# Leading sentences kept from a chunk that matches no query term (dense-only hit)
+CONTEXT_UNMATCHED_SENTENCES = int(os.getenv("CONTEXT_UNMATCHED_SENTENCES", "3"))
+# Spanish averages a bit under 4 characters per token for llama/gemini tokenizers
+CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "3.5"))
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def split_sentences(text: str) -> List[str]:
+    # PDF extraction breaks lines mid-sentence; single newlines are just spaces
+    sentences = (_WHITESPACE_RE.sub(" ", part).strip() for part in _SENTENCE_END_RE.split(text))
+    return [sentence for sentence in sentences if sentence]
+
+
+class PackedContext:
+    def __init__(self, text: str, tokens: int, chunks_used: int, duplicates_dropped: int):
+        self.text = text
+        self.tokens = tokens
+        self.chunks_used = chunks_used
+        self.duplicates_dropped = duplicates_dropped
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a prompt context under a token budget.
+
+    1. Drops chunks that are near-duplicates of a better-ranked one (the
+       manuals overlap heavily), and sentences already included.
+    2. Trims each chunk to the sentences that mention query terms, plus
+       their neighbours.
+    3. Adds sentences in rank order until the budget is spent.
+    """
+
+    def __init__(self, budget_tokens: int, dedup_threshold: float = 0.8, neighbor_sentences: int = 1, unmatched_sentences: int = 3):
+        self.budget_tokens = budget_tokens
+        self.dedup_threshold = dedup_threshold
+        self.neighbor_sentences = neighbor_sentences
+        self.unmatched_sentences = unmatched_sentences
+
+    @classmethod
+    def from_env(cls, provider: str):
+        default_budget = DEFAULT_CONTEXT_TOKENS.get(provider, 2000)
+        return cls(
+            budget_tokens=int(os.getenv(f"{provider.upper()}_CONTEXT_TOKENS", default_budget)),
+            dedup_threshold=CONTEXT_DEDUP_THRESHOLD,
+            neighbor_sentences=CONTEXT_NEIGHBOR_SENTENCES,
+            unmatched_sentences=CONTEXT_UNMATCHED_SENTENCES,
+        )
+
+    def _select_sentences(self, sentences: List[str], query_terms: Set[str]) -> List[str]:
+        matched = [i for i, sentence in enumerate(sentences) if query_terms.intersection(tokenize(sentence))]
+        if not matched:
+            return sentences[:self.unmatched_sentences]
+        keep = set()
+        for i in matched:
+            keep.update(range(max(0, i - self.neighbor_sentences), min(len(sentences), i + self.neighbor_sentences + 1)))
+        return [sentences[i] for i in sorted(keep)]
+
+    def build(self, query: str, docs: List[Document], reserved_tokens: int = 0) -> PackedContext:
+        """`reserved_tokens` of the budget are already taken by other prompt parts (conversation history)."""
+        query_terms = set(tokenize(query))
+        kept_term_sets: List[Set[str]] = []
+        seen_sentences: Set[str] = set()
+        duplicates = 0
+
+        parts = []
+        budget = max(self.budget_tokens - reserved_tokens, 0)
+        remaining = budget
+        for doc in docs:
+            terms = set(tokenize(doc.page_content))
+            if any(len(terms & other) / max(len(terms | other), 1) >= self.dedup_threshold for other in kept_term_sets):
+                duplicates += 1
+                continue
+            kept_term_sets.append(terms)
+
+            selected = []
+            for sentence in self._select_sentences(split_sentences(doc.page_content), query_terms):
+                key = " ".join(tokenize(sentence)) or sentence
+                if key in seen_sentences:
+                    continue
+                cost = estimate_tokens(sentence) + 1
+                if cost > remaining:
+                    continue
+                seen_sentences.add(key)
+                selected.append(sentence)
+                remaining -= cost
+            if selected:
+                parts.append(" ".join(selected))
+            if remaining < 20:
+                break
+
+        text = "\n\n".join(parts)
+        return PackedContext(text, budget - remaining, len(parts), duplicates)
@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import asyncio
+import datetime
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, List, Optional
+
+from bm25_index import tokenize
+from intent_router import normalize
+from context_builder import estimate_tokens, split_sentences, CHARS_PER_TOKEN
+
+# Conversations kept in memory (least recently used ones are spilled or dropped)
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+# A conversation idle for longer than this starts over
+CONVERSATION_IDLE_SECONDS = float(os.getenv("CONVERSATION_IDLE_SECONDS", "14400"))
+# Last turns kept verbatim; older ones are folded into the summary
+CONVERSATION_TURNS = int(os.getenv("CONVERSATION_TURNS", "3"))
+# Prompt tokens for summary + recent turns; taken out of the follow-up's context budget
+CONVERSATION_HISTORY_TOKENS = int(os.getenv("CONVERSATION_HISTORY_TOKENS", "300"))
+# Part of the history budget the rolling summary may use
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "90"))
+# Terms of the previous retrieval query carried into a follow-up's query
+CONVERSATION_TOPIC_TERMS = int(os.getenv("CONVERSATION_TOPIC_TERMS", "6"))
+# Write evicted and idle conversations to Postgres and read them back on the next question
+CONVERSATION_SPILL = os.getenv("CONVERSATION_SPILL", "true").lower() == "true"
+CONVERSATION_SPILL_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_SPILL_INTERVAL_SECONDS", "5"))
+
+# "¿Y en Windows?", "¿Eso sirve para primaria?", "Dame otro ejemplo", "¿Por qué?"
+FOLLOW_UP_STARTERS = {"y", "e", "pero", "entonces", "ademas", "tambien", "osea"}
+FOLLOW_UP_REFERENCES = {"eso", "esa", "ese", "esos", "esas", "esto", "anterior", "mismo", "misma", "ahi"}
+# "lo" is a cue as a clitic ("¿cómo lo hago?"), not as an article ("lo que necesito", "lo más importante")
+FOLLOW_UP_LO_ARTICLE_BEFORE = {
+    "que", "mas", "menos", "mejor", "peor", "primero", "ultimo", "importante", "basico", "principal",
+    "necesario", "ideal", "general", "normal", "de", "del", "cual",
+}
+# "otro"/"otra" is a cue in "otro ejemplo"-style phrases, not in "de una aplicación a otra"
+FOLLOW_UP_OTHER = {"otro", "otra", "otros", "otras"}
+FOLLOW_UP_OTHER_NOUNS = {
+    "ejemplo", "ejemplos", "forma", "formas", "manera", "maneras", "opcion", "opciones", "idea", "ideas",
+    "alternativa", "alternativas", "caso", "casos", "cosa", "cosas", "mas", "vez",
+}
+# Terms that name no topic: a question made only of these is elliptical
+FOLLOW_UP_GENERIC_TERMS = {
+    "hago", "hacer", "hacerlo", "puedo", "puede", "funciona", "sirve", "usar", "usarlo", "explicame", "explica",
+    "dame", "decime", "mostrame", "ejemplo", "ejemplos", "detalle", "detalles", "paso", "pasos", "mejor", "menos",
+    "porque", "quien", "cuanto", "cuantos", "seguro", "bien", "ok", "dale", "sigue", "segui", "continua",
+    "tenes", "tienes", "otro", "otra", "otros", "otras",
+}
+
+
+class Turn:
+    __slots__ = ("question", "answer", "query")
+
+    def __init__(self, question: str, answer: str, query: str):
+        self.question = question
+        self.answer = answer
+        self.query = query  # what retrieval searched for (the rewritten query for follow-ups)
+
+
+class FollowUp:
+    """What a follow-up question needs from the conversation."""
+
+    def __init__(self, query: str, history: str):
+        self.query = query      # retrieval query with the topic of the previous turns
+        self.history = history  # summary + recent turns, for the prompt
+        self.tokens = estimate_tokens(history)
+
+
+class _Conversation:
+    def __init__(self, summary: Optional[List[str]] = None, turns: Optional[List[Turn]] = None, updated_at: float = 0.0):
+        self.summary = deque(summary or [])
+        self.turns = deque(turns or [])
+        self.updated_at = updated_at or time.time()
+
+
+def _clip(text: str, tokens: int) -> str:
+    """Leading sentences of `text` that fit in `tokens` (hard cut if the first one does not)."""
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        cost = estimate_tokens(sentence) + 1
+        if used + cost > tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    return " ".join(kept) if kept else text[:int(tokens * CHARS_PER_TOKEN)]
+
+
+def _has_reference(words: List[str]) -> bool:
+    for i, word in enumerate(words):
+        following = words[i + 1] if i + 1 < len(words) else None
+        if word in FOLLOW_UP_REFERENCES:
+            return True
+        if word == "lo" and following is not None and following not in FOLLOW_UP_LO_ARTICLE_BEFORE:
+            return True
+        if word in FOLLOW_UP_OTHER and following in FOLLOW_UP_OTHER_NOUNS:
+            return True
+    return False
+
+
+def is_follow_up(question: str) -> bool:
+    """Whether the wording points back at earlier turns.
+
+    Needs a cue: a leading connective ("¿y en Windows?"), a reference
+    ("¿eso sirve?", "¿cómo lo hago?", "dame otro ejemplo"), or no topic
+    term at all ("¿por qué?", "¿tenés otro?"). "¿Cómo calibro la
+    pantalla?" and "¿Qué es lo más importante al usar la pantalla?"
+    stand on their own.
+    """
+    words = normalize(question).split()
+    if not words:
+        return False
+    return (
+        words[0] in FOLLOW_UP_STARTERS
+        or _has_reference(words)
+        or not set(tokenize(question)) - FOLLOW_UP_GENERIC_TERMS
+    )
+
+
+class ConversationMemory:
+    """Bounded per-user conversation state for follow-up questions.
+
+    Each user keeps the last few turns verbatim plus a rolling summary. When
+    a turn leaves the window, its question and the first sentence of its
+    answer become one summary line, and the oldest lines are dropped once
+    the summary is over its budget. This is extractive, so it costs no LLM
+    call, and the history rendered into a prompt never exceeds
+    `history_tokens` however long the conversation runs.
+
+    Conversations live in an LRU. With a session factory (see start()),
+    evicted ones are written to Postgres in the background and read back
+    when their user asks again.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_seconds: float = 14400, turns: int = 3,
+                 history_tokens: int = 300, summary_tokens: int = 90, spill_interval: float = 5.0):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.turns = turns
+        self.history_tokens = history_tokens
+        self.summary_tokens = min(summary_tokens, history_tokens // 2)
+        self.spill_interval = spill_interval
+        self.session_factory = None
+
+        self._sessions: "OrderedDict[Hashable, _Conversation]" = OrderedDict()
+        self._spilling: Dict[Hashable, _Conversation] = {}  # evicted, not yet written
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.follow_ups = 0
+        self.standalone = 0
+        self.spilled = 0
+        self.restored = 0
+        self.failed_spills = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_sessions=CONVERSATION_MAX_SESSIONS,
+            idle_seconds=CONVERSATION_IDLE_SECONDS,
+            turns=CONVERSATION_TURNS,
+            history_tokens=CONVERSATION_HISTORY_TOKENS,
+            summary_tokens=CONVERSATION_SUMMARY_TOKENS,
+            spill_interval=CONVERSATION_SPILL_INTERVAL_SECONDS,
+        )
+
+    # --- LOOKUP ---
+
+    def _fresh(self, conversation: Optional[_Conversation]) -> Optional[_Conversation]:
+        if conversation is None or time.time() - conversation.updated_at > self.idle_seconds:
+            return None
+        return conversation
+
+    def _cached(self, user: Hashable) -> Optional[_Conversation]:
+        with self._lock:
+            conversation = self._sessions.get(user)
+            if conversation is not None:
+                self._sessions.move_to_end(user)
+                return self._fresh(conversation)
+            conversation = self._spilling.pop(user, None)
+            if conversation is not None:
+                self._put(user, conversation)
+            return self._fresh(conversation)
+
+    def get(self, user: Hashable) -> Optional[_Conversation]:
+        """The user's live conversation, read back from Postgres if it was spilled (blocking)."""
+        if user is None:
+            return None
+        conversation = self._cached(user)
+        if conversation is None and self.session_factory is not None:
+            conversation = self._fresh(self._load(user))
+            if conversation is not None:
+                with self._lock:
+                    self._put(user, conversation)
+        return conversation
+
+    def follow_up(self, user: Hashable, question: str) -> Optional[FollowUp]:
+        """History and rewritten retrieval query, if `question` leans on earlier turns.
+
+        Only follow-ups look the conversation up (and may read it back from Postgres).
+        """
+        if user is None or not is_follow_up(question):
+            self.standalone += 1
+            return None
+        return self._follow_up(self.get(user), question)
+
+    async def afollow_up(self, user: Hashable, question: str) -> Optional[FollowUp]:
+        if user is None or not is_follow_up(question):
+            self.standalone += 1
+            return None
+        return self._follow_up(await self._aget(user), question)
+
+    async def ais_follow_up(self, user: Hashable, question: str) -> bool:
+        """Whether afollow_up() would answer in the conversation, without counting the question."""
+        if user is None or not is_follow_up(question):
+            return False
+        conversation = await self._aget(user)
+        return conversation is not None and bool(conversation.turns)
+
+    async def _aget(self, user: Hashable) -> Optional[_Conversation]:
+        conversation = self._cached(user)
+        if conversation is None and self.session_factory is not None:
+            # A spilled conversation is read back once; later lookups find it in memory
+            conversation = await asyncio.to_thread(self.get, user)
+        return conversation
+
+    def _follow_up(self, conversation: Optional[_Conversation], question: str) -> Optional[FollowUp]:
+        if conversation is None or not conversation.turns:
+            self.standalone += 1
+            return None
+        self.follow_ups += 1
+        with self._lock:
+            previous_query = conversation.turns[-1].query
+            history = self._render(conversation)
+        # Carry the topic forward: terms of the previous retrieval query, then the question's own
+        own_terms = set(tokenize(question))
+        topic = [term for term in dict.fromkeys(tokenize(previous_query)) if term not in own_terms]
+        return FollowUp(" ".join(topic[:CONVERSATION_TOPIC_TERMS] + [question]), history)
+
+    @staticmethod
+    def _render(conversation: _Conversation) -> str:
+        parts = []
+        if conversation.summary:
+            parts.append("Temas anteriores:\n" + "\n".join(conversation.summary))
+        for turn in conversation.turns:
+            parts.append(f"Docente: {turn.question}\nAsistente: {turn.answer}")
+        return "\n\n".join(parts)
+
+    # --- UPDATE ---
+
+    def record(self, user: Hashable, question: str, answer: str, query: str):
+        """Adds a finished turn, folding the oldest ones into the summary to stay in budget."""
+        if user is None or not answer:
+            return
+        turn_tokens = self.history_tokens - self.summary_tokens
+        # Each verbatim turn gets an equal share: the question and the start of the answer
+        per_turn = turn_tokens // self.turns
+        question = _clip(question, per_turn // 3)
+        answer = _clip(answer, per_turn - estimate_tokens(question) - 8)
+        with self._lock:
+            # Not in memory: start over (a standalone question after a spill is a change of topic anyway)
+            conversation = self._fresh(self._sessions.get(user) or self._spilling.pop(user, None)) or _Conversation()
+            conversation.turns.append(Turn(question, answer, query))
+            while len(conversation.turns) > 1 and (
+                len(conversation.turns) > self.turns
+                or sum(estimate_tokens(t.question) + estimate_tokens(t.answer) + 8 for t in conversation.turns) > turn_tokens
+            ):
+                self._summarize(conversation, conversation.turns.popleft())
+            conversation.updated_at = time.time()
+            self._put(user, conversation)
+
+    def _summarize(self, conversation: _Conversation, turn: Turn):
+        first_sentence = (split_sentences(turn.answer) or [""])[0]
+        conversation.summary.append(_clip(f"- {turn.question} → {first_sentence}", self.summary_tokens // 2))
+        while sum(estimate_tokens(line) + 1 for line in conversation.summary) > self.summary_tokens:
+            conversation.summary.popleft()
+
+    def forget(self, user: Hashable):
+        """Starts the user's next question on a clean slate."""
+        with self._lock:
+            self._spilling.pop(user, None)
+            # An empty conversation (rather than none) also replaces a spilled one when written
+            self._put(user, _Conversation())
+
+    def _put(self, user: Hashable, conversation: _Conversation):
+        # Caller holds the lock
+        self._sessions[user] = conversation
+        self._sessions.move_to_end(user)
+        while len(self._sessions) > self.max_sessions:
+            evicted_user, evicted = self._sessions.popitem(last=False)
+            if self.session_factory is not None and self._fresh(evicted) is not None:
+                self._spilling[evicted_user] = evicted
+
+    # --- POSTGRES SPILL ---
+
+    def _load(self, user: Hashable) -> Optional[_Conversation]:
+        from models import Conversation
+        db = self.session_factory()
+        try:
+            row = db.get(Conversation, user)
+            if row is None:
+                return None
+            data = json.loads(row.turns or "[]")
+            self.restored += 1
+            return _Conversation(
+                summary=json.loads(row.summary or "[]"),
+                turns=[Turn(t["question"], t["answer"], t["query"]) for t in data],
+                updated_at=row.updated_at.replace(tzinfo=datetime.timezone.utc).timestamp(),
+            )
+        except Exception as e:
+            print(f"Error loading conversation of user {user}: {e}")
+            return None
+        finally:
+            db.close()
+
+    def flush(self):
+        """Writes the evicted conversations in one transaction."""
+        with self._lock:
+            if not self._spilling:
+                return
+            batch, self._spilling = self._spilling, {}
+
+        from models import Conversation
+        db = self.session_factory()
+        try:
+            for user, conversation in batch.items():
+                db.merge(Conversation(
+                    user_id=user,
+                    summary=json.dumps(list(conversation.summary), ensure_ascii=False),
+                    turns=json.dumps([{"question": t.question, "answer": t.answer, "query": t.query} for t in conversation.turns], ensure_ascii=False),
+                    updated_at=datetime.datetime.fromtimestamp(conversation.updated_at, datetime.timezone.utc).replace(tzinfo=None),
+                ))
+            db.commit()
+            self.spilled += len(batch)
+        except Exception as e:
+            db.rollback()
+            self.failed_spills += 1
+            print(f"Error spilling conversations: {e}. Will retry.")
+            with self._lock:
+                # Newer state (the user came back meanwhile) wins over the retry
+                for user, conversation in batch.items():
+                    if user not in self._sessions:
+                        self._spilling.setdefault(user, conversation)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.spill_interval):
+            self.flush()
+
+    def start(self, session_factory):
+        """Enables the Postgres spill (CONVERSATION_SPILL) and its background writer."""
+        if not CONVERSATION_SPILL or self._thread is not None:
+            return
+        self.session_factory = session_factory
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="conversation-spill", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the writer and spills every live conversation, so a restart resumes them."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            for user, conversation in self._sessions.items():
+                if self._fresh(conversation) is not None:
+                    self._spilling[user] = conversation
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = len(self._sessions)
+            pending = len(self._spilling)
+        return {
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "follow_ups": self.follow_ups,
+            "standalone": self.standalone,
+            "pending_spill": pending,
+            "spilled": self.spilled,
+            "restored": self.restored,
+            "failed_spills": self.failed_spills,
+            "history_tokens": self.history_tokens,
+        }
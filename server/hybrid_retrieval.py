@@ -0,0 +1,68 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+
+# Retrieval tuning
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+HYBRID_DENSE_WEIGHT = float(os.getenv("HYBRID_DENSE_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], rrf_k: int = 60) -> List[str]:
+    """Fuses ranked id lists: score(id) = sum(weight / (rrf_k + rank))."""
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if weight <= 0:
+            continue
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever:
+    """Dense (FAISS) + lexical (BM25) retrieval fused with reciprocal rank fusion.
+
+    Callers pass the query vector, so embedding can be batched or cached upstream.
+    """
+
+    def __init__(self, vector_store: Any, lexical_index: Optional[Any] = None, k: int = RETRIEVAL_K,
+                 candidates: int = HYBRID_CANDIDATES, dense_weight: float = HYBRID_DENSE_WEIGHT,
+                 lexical_weight: float = HYBRID_LEXICAL_WEIGHT, rrf_k: int = HYBRID_RRF_K):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.k = k
+        self.candidates = candidates
+        self.dense_weight = dense_weight
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+
+    def _dense_ids(self, query_vector: List[float]) -> List[str]:
+        vector = np.array([query_vector], dtype=np.float32)
+        n = min(self.candidates, self.vector_store.index.ntotal)
+        if n == 0:
+            return []
+        _, positions = self.vector_store.index.search(vector, n)
+        mapping = self.vector_store.index_to_docstore_id
+        return [mapping[int(i)] for i in positions[0] if i != -1]
+
+    def retrieve(self, query: str, query_vector: List[float], k: Optional[int] = None) -> List[Document]:
+        k = k or self.k
+        dense = self._dense_ids(query_vector)
+        if self.lexical_index is not None and self.lexical_weight > 0:
+            lexical = [doc_id for doc_id, _ in self.lexical_index.search(query, self.candidates)]
+            ranked = reciprocal_rank_fusion([dense, lexical], [self.dense_weight, self.lexical_weight], self.rrf_k)
+        else:
+            ranked = dense
+
+        docs = []
+        for doc_id in ranked:
+            doc = self.vector_store.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+            if len(docs) == k:
+                break
+        return docs
@@ -0,0 +1,147 @@
+import os
+import re
+import shutil
+
+from compact_store import has_compact_index, has_pickle_index
+
+# The vector index depends only on the embedding model and the chunking
+# settings, never on the LLM provider, so every provider shares one store.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+VECTOR_STORE_ROOT = os.getenv("VECTOR_STORE_ROOT", "faiss_index_shared")
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+LEGACY_PROCESSED_FILENAME = "processed_files.txt"
+
+# Each (re)ingestion writes a new generation directory next to the served
+# one; CURRENT names the generation to load. An index saved directly in the
+# root (from before generations) is served until the first change.
+CURRENT_FILENAME = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+# Old per-provider layout. All of them were built with the same model and the
+# default load_and_split() chunking, so their vectors are interchangeable.
+LEGACY_INDEX_PATHS = {
+    "ollama": "faiss_index_ollama_local",
+    "gemini": "faiss_index_gemini_local",
+    "deepseek": "faiss_index_deepseek_local",
+}
+LEGACY_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LEGACY_CHUNKING = (4000, 200)
+
+
+def shared_index_path(model_name: str, chunk_size: int, chunk_overlap: int) -> str:
+    """Directory for the index built with this model + chunking configuration."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name.replace("/", "__"))
+    return os.path.join(VECTOR_STORE_ROOT, f"{slug}_c{chunk_size}_o{chunk_overlap}")
+
+
+def _has_index(path: str) -> bool:
+    return has_pickle_index(path) or has_compact_index(path)
+
+
+def current_generation_path(index_path: str) -> str:
+    """Directory of the generation CURRENT points at (the root for the flat layout)."""
+    try:
+        with open(os.path.join(index_path, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return index_path
+    path = os.path.join(index_path, name)
+    return path if name and os.path.isdir(path) else index_path
+
+
+def new_generation_path(index_path: str) -> str:
+    """Creates the next, empty generation directory."""
+    os.makedirs(index_path, exist_ok=True)
+    numbers = [int(name[len(GENERATION_PREFIX):]) for name in os.listdir(index_path)
+               if name.startswith(GENERATION_PREFIX) and name[len(GENERATION_PREFIX):].isdigit()]
+    path = os.path.join(index_path, f"{GENERATION_PREFIX}{max(numbers, default=0) + 1:06d}")
+    os.makedirs(path)
+    return path
+
+
+def publish_generation(index_path: str, generation_path: str):
+    """Points CURRENT at the generation. The rename is atomic: a crash leaves the old or the new one."""
+    tmp_path = os.path.join(index_path, CURRENT_FILENAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(generation_path))
+    os.replace(tmp_path, os.path.join(index_path, CURRENT_FILENAME))
+
+
+def remove_old_generations(index_path: str, keep_path: str) -> int:
+    """Deletes every generation except `keep_path`, plus a flat-layout index it replaced.
+
+    Readers still holding memory maps of a deleted generation keep working
+    until they let go (POSIX unlink semantics). Where deletion fails (open
+    files on Windows) the next run tries again.
+    """
+    removed = 0
+    for name in os.listdir(index_path):
+        path = os.path.join(index_path, name)
+        if path == keep_path or name.startswith(CURRENT_FILENAME):
+            continue
+        if os.path.isdir(path) and name.startswith(GENERATION_PREFIX):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += not os.path.exists(path)
+        elif os.path.isfile(path) and keep_path != index_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return removed
+
+
+def migrate_legacy_index(index_path: str, provider: str, data_dir: str, model_name: str, chunking: tuple) -> bool:
+    """Seeds the shared index from an old per-provider index, if compatible.
+
+    The active provider's directory is preferred. Its tracking file (the JSON
+    manifest, or the older filename list) is copied next to the index so the
+    ingest manifest can be rebuilt without re-embedding.
+    """
+    if _has_index(current_generation_path(index_path)):
+        return False
+    if model_name != LEGACY_EMBEDDING_MODEL or tuple(chunking) != LEGACY_CHUNKING:
+        return False
+
+    candidates = [provider] + [p for p in LEGACY_INDEX_PATHS if p != provider]
+    for legacy_provider in candidates:
+        legacy_path = LEGACY_INDEX_PATHS.get(legacy_provider)
+        if not legacy_path or not has_pickle_index(legacy_path):
+            continue
+
+        print(f"Migrating legacy index {legacy_path} -> {index_path}...")
+        os.makedirs(index_path, exist_ok=True)
+        for name in ("index.faiss", "index.pkl"):
+            shutil.copy2(os.path.join(legacy_path, name), os.path.join(index_path, name))
+
+        legacy_manifest = os.path.join(data_dir, f"ingest_manifest_{legacy_provider}.json")
+        legacy_processed = os.path.join(data_dir, f"processed_files_{legacy_provider}.txt")
+        if os.path.exists(legacy_manifest):
+            shutil.copy2(legacy_manifest, os.path.join(index_path, MANIFEST_FILENAME))
+        elif os.path.exists(legacy_processed):
+            shutil.copy2(legacy_processed, os.path.join(index_path, LEGACY_PROCESSED_FILENAME))
+        return True
+
+    return False
+
+
+def remove_legacy_indexes(data_dir: str):
+    """Deletes the duplicated per-provider indexes once the shared one is in use.
+
+    Only files are removed; the directories may be bind-mounted volumes, so
+    removing them is best effort.
+    """
+    for provider, legacy_path in LEGACY_INDEX_PATHS.items():
+        for name in ("index.faiss", "index.pkl"):
+            path = os.path.join(legacy_path, name)
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"Removed duplicate legacy index file {path}.")
+        for name in (f"ingest_manifest_{provider}.json", f"processed_files_{provider}.txt"):
+            path = os.path.join(data_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(legacy_path)
+        except OSError:
+            pass
@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+from langchain.docstore.document import Document
+
+# Chunking settings (same values load_and_split() used implicitly before)
+CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "4000"))
+CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", "200"))
+
+# Pipeline tuning
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+CHECKPOINT_EVERY_FILES = int(os.getenv("INGEST_CHECKPOINT_EVERY_FILES", "50"))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_ids(filename: str, sha256: str, count: int) -> List[str]:
+    """Chunk ids derived from name + content: stable across runs for an unchanged
+    file, and distinct for two files that happen to have identical bytes."""
+    key = hashlib.sha256(f"{filename}\0{sha256}".encode("utf-8")).hexdigest()[:16]
+    return [f"{key}-{i}" for i in range(count)]
+
+
+def parse_and_split(file_path: str) -> Tuple[str, List[Document], str]:
+    """Parses a PDF into chunks. Runs inside the worker processes.
+
+    Returns (file_path, docs, error). Errors are returned instead of raised so
+    one broken PDF does not abort the whole batch.
+    """
+    # Imported here: only ingestion needs the PDF parser and the splitter
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    try:
+        loader = PyPDFLoader(file_path)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        return file_path, loader.load_and_split(text_splitter=splitter), ""
+    except Exception as e:
+        return file_path, [], str(e)
+
+
+def parse_files(file_paths: List[str]):
+    """Yields parse_and_split results, fanning out to a process pool when useful."""
+    if len(file_paths) <= 1 or INGEST_WORKERS <= 1:
+        for path in file_paths:
+            yield parse_and_split(path)
+        return
+
+    # "spawn" keeps the workers light: they never inherit the parent's torch/FAISS state
+    context = multiprocessing.get_context("spawn")
+    workers = min(INGEST_WORKERS, len(file_paths))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(parse_and_split, path) for path in file_paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class IngestManifest:
+    """Tracks which file contents are in the index.
+
+    Maps filename -> {"sha256": ..., "ids": [...]}, so an edited PDF (same
+    name, new hash) gets its old chunks replaced and a deleted PDF gets its
+    chunks removed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, dict] = {}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+            return True
+        except Exception as e:
+            print(f"Error reading ingest manifest {self.path}: {e}. Starting fresh.")
+            self.files = {}
+            return False
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def migrate_from_processed_list(self, processed_list_path: str, directory_path: str, vector_store):
+        """Builds the manifest from the old filename-only processed_files_<provider>.txt.
+
+        Chunk ids are recovered from the docstore by matching the "source"
+        metadata, so files already in the index are not re-embedded.
+        """
+        if not os.path.exists(processed_list_path) or vector_store is None:
+            return
+        with open(processed_list_path, "r") as f:
+            processed = [line for line in f.read().splitlines() if line]
+
+        ids_by_file: Dict[str, List[str]] = {}
+        for doc_id in vector_store.index_to_docstore_id.values():
+            doc = vector_store.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                source = os.path.basename(doc.metadata.get("source", ""))
+                ids_by_file.setdefault(source, []).append(doc_id)
+
+        for filename in processed:
+            file_path = os.path.join(directory_path, filename)
+            if filename in ids_by_file and os.path.exists(file_path):
+                self.files[filename] = {"sha256": file_sha256(file_path), "ids": ids_by_file[filename]}
+        print(f"Migrated {len(self.files)} entries from {os.path.basename(processed_list_path)}.")
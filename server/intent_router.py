@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import time
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from bm25_index import fold_accents
+
+FAQ_PATH = os.getenv("FAQ_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq.json"))
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.82"))
+FAQ_RELOAD_INTERVAL_SECONDS = float(os.getenv("FAQ_RELOAD_INTERVAL_SECONDS", "5"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """"¡Hola, qué tal!" -> "hola que tal"."""
+    return " ".join(_WORD_RE.findall(fold_accents(text)))
+
+
+class IntentMatch:
+    def __init__(self, name: str, answer: str, score: float):
+        self.name = name
+        self.answer = answer
+        self.score = score
+
+
+class IntentRouter:
+    """Answers greetings, thanks and FAQ questions from a curated file.
+
+    Every example question in the file is embedded once. A query goes to the
+    entry of its nearest example when the cosine similarity clears the
+    threshold (global, or per entry) and the query is not longer than the
+    entry's max_words. Exact matches after normalization always route.
+
+    The file is re-read when its mtime changes, checked at most every
+    `reload_interval` seconds. A broken file keeps the previous intents.
+    """
+
+    def __init__(self, path: str, embeddings, threshold: float = 0.82, reload_interval: float = 5.0):
+        self.path = path
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.reload_interval = reload_interval
+
+        # (entries, example matrix, example -> entry index, normalized example -> entry index)
+        # Replaced as a whole on reload, so route() needs no lock
+        self._state = None
+        self._mtime = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, embeddings):
+        return cls(FAQ_PATH, embeddings, threshold=FAQ_THRESHOLD, reload_interval=FAQ_RELOAD_INTERVAL_SECONDS)
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def needs_reload(self) -> bool:
+        """Cheap check (one stat, rate limited) for a changed file."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.reload_interval
+        return self._file_mtime() != self._mtime
+
+    def reload(self):
+        with self._reload_lock:
+            mtime = self._file_mtime()
+            if self._state is not None and mtime == self._mtime:
+                return
+            self._mtime = mtime
+            if mtime is None:
+                print(f"FAQ file {self.path} not found. Intent routing disabled.")
+                self._state = None
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)["intents"]
+                examples, owners, exact = [], [], {}
+                for index, entry in enumerate(entries):
+                    if not entry.get("answer") or not entry.get("examples"):
+                        raise ValueError(f"intent {entry.get('name')!r} needs 'answer' and 'examples'")
+                    for example in entry["examples"]:
+                        examples.append(example)
+                        owners.append(index)
+                        exact[normalize(example)] = index
+                matrix = np.array(self.embeddings.embed_documents(examples), dtype=np.float32)
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                self._state = (entries, matrix, np.array(owners), exact)
+                print(f"Loaded {len(entries)} intents ({len(examples)} examples) from {self.path}.")
+            except Exception as e:
+                print(f"Error loading FAQ file {self.path}: {e}. Keeping previous intents.")
+
+    def route(self, query: str, query_vector: List[float]) -> Optional[IntentMatch]:
+        state = self._state
+        if state is None:
+            return None
+        entries, matrix, owners, exact = state
+
+        normalized = normalize(query)
+        if normalized in exact:
+            entry = entries[exact[normalized]]
+            return IntentMatch(entry["name"], entry["answer"], 1.0)
+
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        scores = matrix @ (vector / norm)
+        best = int(np.argmax(scores))
+        entry = entries[owners[best]]
+        score = float(scores[best])
+        if score < entry.get("threshold", self.threshold):
+            return None
+        # "hola, ¿cómo calibro la pantalla?" is a question, not a greeting
+        max_words = entry.get("max_words")
+        if max_words and len(normalized.split()) > max_words:
+            return None
+        return IntentMatch(entry["name"], entry["answer"], score)
@@ -0,0 +1,120 @@
+import os
+import threading
+from typing import Dict
+
+from sqlalchemy import update, bindparam
+
+from models import Post
+
+
+class LikeCounter:
+    """Write-behind counter for post likes.
+
+    Likes are added to in-memory deltas and flushed to Postgres every
+    `interval` seconds as one batched `UPDATE posts SET likes = likes + n`.
+    A burst of likes on one post becomes a single row update, and no
+    request waits on the row lock. Readers add pending() to the stored
+    count so totals look immediate.
+    """
+
+    def __init__(self, session_factory, interval: float = 1.0):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._pending: Dict[int, int] = {}
+        self._flushing: Dict[int, int] = {}  # deltas being written right now
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Called after each committed flush (e.g. to drop cached counts)
+        self.on_flush = None
+
+        self.flushes = 0
+        self.flushed_likes = 0
+        self.failed_flushes = 0
+
+    @classmethod
+    def from_env(cls, session_factory):
+        return cls(session_factory, interval=float(os.getenv("LIKE_FLUSH_INTERVAL_SECONDS", "1.0")))
+
+    def increment(self, post_id: int, amount: int = 1):
+        with self._lock:
+            self._pending[post_id] = self._pending.get(post_id, 0) + amount
+
+    def pending(self, post_id: int) -> int:
+        with self._lock:
+            return self._pending.get(post_id, 0) + self._flushing.get(post_id, 0)
+
+    def pending_snapshot(self) -> Dict[int, int]:
+        with self._lock:
+            merged = dict(self._flushing)
+            for post_id, delta in self._pending.items():
+                merged[post_id] = merged.get(post_id, 0) + delta
+            return merged
+
+    def flush(self):
+        """Writes all pending deltas in one transaction."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+                batch = dict(self._flushing)
+
+            db = self.session_factory()
+            try:
+                statement = (
+                    update(Post.__table__)
+                    .where(Post.__table__.c.id == bindparam("post_id"))
+                    .values(likes=Post.__table__.c.likes + bindparam("delta"))
+                )
+                db.execute(statement, [{"post_id": post_id, "delta": delta} for post_id, delta in batch.items()])
+                db.commit()
+                # The stored counts now include the batch: stop adding it on top
+                with self._lock:
+                    self._flushing = {}
+                self.flushes += 1
+                self.flushed_likes += sum(batch.values())
+            except Exception as e:
+                db.rollback()
+                with self._lock:
+                    # Put the deltas back so the next flush retries them
+                    for post_id, delta in batch.items():
+                        self._pending[post_id] = self._pending.get(post_id, 0) + delta
+                    self._flushing = {}
+                self.failed_flushes += 1
+                print(f"Error flushing likes: {e}. Will retry.")
+                return
+            finally:
+                db.close()
+            if self.on_flush is not None:
+                self.on_flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="like-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background flusher and writes what is left."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending_likes = sum(self._pending.values())
+        return {
+            "pending_likes": pending_likes,
+            "flushes": self.flushes,
+            "flushed_likes": self.flushed_likes,
+            "failed_flushes": self.failed_flushes,
+            "interval_seconds": self.interval,
+        }
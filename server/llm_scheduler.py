@@ -0,0 +1,170 @@
+import os
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Hashable, Optional
+
+from metrics import LLM_QUEUE_WAIT_SECONDS, LLM_SHED
+
+# Max concurrent generations per provider.
+# A CPU-only Ollama only handles a couple at once; cloud APIs take more.
+DEFAULT_LLM_CONCURRENCY = {
+    "ollama": 2,
+    "gemini": 8,
+    "deepseek": 8,
+}
+# Requests allowed to wait for a slot; beyond this they are turned away
+DEFAULT_LLM_QUEUE = {
+    "ollama": 8,
+    "gemini": 64,
+    "deepseek": 64,
+}
+# Waiting requests one user may hold, so a single user cannot fill the queue
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "2"))
+# Typical time a generation holds its slot, until measured (seconds)
+DEFAULT_SERVICE_SECONDS = {
+    "ollama": 20.0,
+    "gemini": 5.0,
+    "deepseek": 8.0,
+}
+
+
+class SchedulerBusy(Exception):
+    """The provider's wait queue is full."""
+
+    def __init__(self, provider: str, retry_after: int, queue_length: int):
+        super().__init__(f"{provider} is busy ({queue_length} waiting), retry in {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.queue_length = queue_length
+
+
+class FairScheduler:
+    """Concurrency cap plus a bounded, per-user fair wait queue for one provider.
+
+    Waiting requests are kept in one FIFO per user, and a freed slot goes
+    to the next user in round-robin order. A user with ten questions in the
+    queue therefore waits behind one question of every other user, not the
+    other way round. When the queue (or the user's share of it) is full,
+    slot() raises SchedulerBusy at once with an estimate of when to retry.
+    """
+
+    def __init__(self, provider: str, capacity: int, max_queue: int, max_per_user: int = 2, service_seconds: float = 10.0, alpha: float = 0.2):
+        self.provider = provider
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.service_seconds = service_seconds
+        self.alpha = alpha
+        self.active = 0
+        self.queued = 0
+        self.shed = 0
+        self._queues: "OrderedDict[Hashable, deque]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls, provider: str):
+        prefix = provider.upper()
+        return cls(
+            provider,
+            capacity=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", DEFAULT_LLM_CONCURRENCY.get(provider, 4))),
+            max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", DEFAULT_LLM_QUEUE.get(provider, 16))),
+            max_per_user=LLM_MAX_QUEUED_PER_USER,
+            service_seconds=DEFAULT_SERVICE_SECONDS.get(provider, 10.0),
+        )
+
+    def locked(self) -> bool:
+        return self.active >= self.capacity
+
+    def can_admit(self, user: Hashable = None) -> bool:
+        if self.active < self.capacity and not self.queued:
+            return True
+        if user is not None and len(self._queues.get(user, ())) >= self.max_per_user:
+            return False
+        return self.queued < self.max_queue
+
+    def position(self, user: Hashable) -> int:
+        """Where a new request from `user` would wait (0 = runs immediately)."""
+        if self.active < self.capacity and not self.queued:
+            return 0
+        # Round robin: it waits behind up to (own queue + 1) requests of every other user
+        own = len(self._queues.get(user, ()))
+        return own + 1 + sum(min(len(q), own + 1) for u, q in self._queues.items() if u != user)
+
+    def retry_after(self, position: Optional[int] = None) -> int:
+        waiting = self.queued + 1 if position is None else position
+        return max(1, math.ceil(waiting / self.capacity * self.service_seconds))
+
+    def busy_error(self) -> SchedulerBusy:
+        return SchedulerBusy(self.provider, self.retry_after(), self.queued)
+
+    @asynccontextmanager
+    async def slot(self, user: Hashable = None):
+        waited = await self._acquire(user)
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, provider=self.provider)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self.service_seconds = (1 - self.alpha) * self.service_seconds + self.alpha * held
+            self._release()
+
+    async def _acquire(self, user: Hashable) -> float:
+        if self.active < self.capacity and not self.queued:
+            self.active += 1
+            return 0.0
+        if not self.can_admit(user):
+            self.shed += 1
+            LLM_SHED.inc(provider=self.provider)
+            raise self.busy_error()
+
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(waiter)
+        self.queued += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled: pass it on
+                self._release()
+            else:
+                self._forget(user, waiter)
+            raise
+        return time.monotonic() - started
+
+    def _forget(self, user: Hashable, waiter: asyncio.Future):
+        queue = self._queues.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self._queues[user]
+
+    def _release(self):
+        # Hand the slot straight to the next user in the rotation (active stays the same)
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "capacity": self.capacity,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "waiting_users": len(self._queues),
+            "service_seconds": round(self.service_seconds, 2),
+            "shed": self.shed,
+        }
@@ -1,18 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Header
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import random
 import os
+import re
+import json
+import base64
+import hmac
 import time
-from sqlalchemy.orm import Session
-from database import engine, get_db, Base
+import asyncio
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine, async_engine, async_connect_with_retry, get_async_db, Base, SessionLocal
 import models
 from rag_service import rag_service
+from llm_scheduler import SchedulerBusy
 from tts_service import tts_service
-from community_service import community_service
+from community_service import community_service, FEED_PAGE_SIZE
+from speech_stream import stream_speech
+from stream_transport import text_stream, sse_stream
+from metrics import REGISTRY
 
 # Create Tables
 models.Base.metadata.create_all(bind=engine)
+# create_all skips indexes on tables that already exist
+for index in models.Post.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
 
 app = FastAPI()
 
@@ -30,6 +45,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 class ChatRequest(BaseModel):
@@ -47,20 +63,184 @@ class ChatResponse(BaseModel):
 def read_root():
     return {"status": "ok", "message": "Asistente Pedagogico API is running with PostgreSQL"}
 
+@app.get("/ready")
+async def readiness():
+    # "/" answers as soon as the process is up (liveness); this one only once it can serve chat
+    checks = {"rag": rag_service.status, "database": "ok"}
+    try:
+        async with async_engine.connect() as connection:
+            await asyncio.wait_for(connection.execute(text("SELECT 1")), timeout=2)
+    except Exception as e:
+        checks["database"] = f"error: {e}"
+    ready = rag_service.ready and checks["database"] == "ok"
+    if rag_service.warmup_error:
+        checks["rag_error"] = rag_service.warmup_error
+    return JSONResponse({"status": "ready" if ready else "not_ready", "checks": checks}, status_code=200 if ready else 503)
+
+def require_rag_ready():
+    """Chat endpoints answer 503 + Retry-After until the index is loaded."""
+    if not rag_service.ready:
+        raise HTTPException(
+            status_code=503,
+            detail=rag_service.WARMING_UP_MESSAGE,
+            headers={"Retry-After": "5"},
+        )
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return {
+        "answer_cache": rag_service.answer_cache.stats(),
+        "query_embedder": rag_service.query_embedder.stats() if rag_service.query_embedder else None,
+    }
+
+@app.get("/api/providers/stats")
+def provider_stats():
+    # Rolling TTFT, error rate and cooldown per configured LLM provider, plus slot/queue usage
+    return {
+        "routing": rag_service.router.stats() if rag_service.router else {},
+        "scheduling": rag_service.scheduler_stats(),
+    }
+
+@app.get("/api/conversations/stats")
+def conversation_stats():
+    # Live conversations, follow-up vs standalone questions, Postgres spill
+    return rag_service.conversations.stats()
+
+@app.get("/api/index/stats")
+def index_stats():
+    # Generation being served, chunk count and the last hot reload
+    return rag_service.index_stats()
+
+# Maintenance endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.post("/api/admin/reindex", status_code=202, dependencies=[Depends(require_admin)])
+def reindex():
+    """Ingests added, changed or removed PDFs in the background and swaps the index when done."""
+    if not rag_service.ready:
+        raise HTTPException(status_code=503, detail=rag_service.WARMING_UP_MESSAGE, headers={"Retry-After": "5"})
+    started = rag_service.start_reload()
+    return {"started": started, "index": rag_service.index_stats()}
+
+def _service_metrics():
+    """Counters the services already keep (see the /stats endpoints), read at scrape time."""
+    yield ("tomi_rag_ready", "gauge", "1 once the index is loaded.", [({"provider": rag_service.provider}, int(rag_service.ready))])
+
+    conversations = rag_service.conversations.stats()
+    yield ("tomi_conversations", "gauge", "Conversations held in memory.", [({}, conversations["sessions"])])
+    yield ("tomi_chat_questions_total", "counter", "Questions by kind (follow-ups get the conversation history).",
+           [({"kind": "follow_up"}, conversations["follow_ups"]), ({"kind": "standalone"}, conversations["standalone"])])
+
+    index = rag_service.index_stats()
+    yield ("tomi_index_chunks", "gauge", "Chunks in the index generation being served.", [({}, index["chunks"])])
+    yield ("tomi_index_ingesting", "gauge", "1 while an ingestion or hot reload is running.", [({}, int(index["ingesting"]))])
+
+    yield ("tomi_rag_streams_in_flight", "gauge", "Distinct generations currently streaming (after coalescing).", [({}, rag_service.coalescer.in_flight())])
+
+    cache = rag_service.answer_cache.stats()
+    yield ("tomi_answer_cache_lookups_total", "counter", "Semantic answer cache lookups.",
+           [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])])
+    yield ("tomi_answer_cache_entries", "gauge", "Cached answers.", [({}, cache["entries"])])
+
+    if rag_service.query_embedder is not None:
+        embedder = rag_service.query_embedder.stats()
+        yield ("tomi_query_embed_cache_lookups_total", "counter", "Query embedding cache lookups.",
+               [({"result": "hit"}, embedder["cache_hits"]), ({"result": "miss"}, embedder["cache_misses"])])
+        yield ("tomi_query_embed_batches_total", "counter", "Embedding batches run.", [({}, embedder["batches"])])
+        yield ("tomi_query_embed_batched_queries_total", "counter", "Queries embedded in batches.", [({}, embedder["batched_queries"])])
+
+    if rag_service.router is not None:
+        providers = rag_service.router.stats()
+        yield ("tomi_provider_ttft_ewma_seconds", "gauge", "Rolling time to first token per provider.",
+               [({"provider": name}, p["ttft_ewma_ms"] / 1000) for name, p in providers.items()])
+        yield ("tomi_provider_error_rate", "gauge", "Rolling error rate per provider.",
+               [({"provider": name}, p["error_rate"]) for name, p in providers.items()])
+        yield ("tomi_provider_healthy", "gauge", "0 while a provider is cooling down after failures.",
+               [({"provider": name}, int(p["healthy"])) for name, p in providers.items()])
+
+    schedulers = rag_service.scheduler_stats()
+    yield ("tomi_llm_active", "gauge", "Generations holding a provider slot.", [({"provider": name}, st["active"]) for name, st in schedulers.items()])
+    yield ("tomi_llm_queued", "gauge", "Generations waiting for a provider slot.", [({"provider": name}, st["queued"]) for name, st in schedulers.items()])
+
+    tts = tts_service.cache.stats()
+    yield ("tomi_tts_cache_lookups_total", "counter", "TTS cache lookups.",
+           [({"result": "memory_hit"}, tts["memory_hits"]), ({"result": "disk_hit"}, tts["disk_hits"]), ({"result": "miss"}, tts["misses"])])
+    yield ("tomi_tts_cache_bytes", "gauge", "TTS cache size.", [({"tier": "memory"}, tts["memory_bytes"]), ({"tier": "disk"}, tts["disk_bytes"])])
+
+    hashing = auth_service.hash_pool.stats()
+    yield ("tomi_password_hash_pending", "gauge", "Hashes queued or running.", [({}, hashing["pending"])])
+    yield ("tomi_password_hashes_total", "counter", "Hashes by result.",
+           [({"result": "completed"}, hashing["completed"]), ({"result": "rejected"}, hashing["rejected"])])
+
+    likes = community_service.like_counter.stats()
+    yield ("tomi_likes_pending", "gauge", "Likes not yet written to the database.", [({}, likes["pending_likes"])])
+    yield ("tomi_like_flushes_total", "counter", "Like flushes by result.",
+           [({"result": "ok"}, likes["flushes"]), ({"result": "failed"}, likes["failed_flushes"])])
+
+    pools = [({"engine": name}, pool.checkedout()) for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)) if hasattr(pool, "checkedout")]
+    yield ("tomi_db_pool_checked_out", "gauge", "Connections in use.", pools)
+
+REGISTRY.register_collector(_service_metrics)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus text format
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.on_event("startup")
 async def startup_event():
-    # Ingest PDFs on startup
-    data_dir = os.path.join(os.path.dirname(__file__), "data")
-    rag_service.ingest_pdfs(data_dir)
+    # Load models and ingest PDFs in the background; /ready reports when done
+    data_dir = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
+    rag_service.start_warm_up(data_dir)
+    # Warm the async pool so the first request does not pay for the connect
+    await async_connect_with_retry(async_engine)
+    community_service.like_counter.start()
+    # Conversations evicted from memory are kept in Postgres
+    rag_service.conversations.start(SessionLocal)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write buffered likes before the process exits
+    community_service.like_counter.stop()
+    if rag_service.router is not None:
+        rag_service.router.stop()
+    rag_service.stop_index_watcher()
+    # Spill live conversations so they survive the restart
+    rag_service.conversations.stop()
+    await async_engine.dispose()
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 
 # ... (existing code)
 
 from auth_service import get_current_user, User
 
-@app.post("/api/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, current_user: User = Depends(get_current_user)):
+async def check_llm_capacity(message: str, user_id: int, coalesce: bool = False) -> Optional[int]:
+    """Sheds chat requests up front (429 + Retry-After) when every provider's
+    wait queue is full. Questions answered without the LLM (canned intents,
+    cached answers) always pass. Returns the queue position, if any."""
+    try:
+        return await rag_service.aadmit(message, user_id, coalesce=coalesce)
+    except SchedulerBusy as e:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "message": rag_service.BUSY_MESSAGE.format(seconds=e.retry_after),
+                "retry_after": e.retry_after,
+                "queue_length": e.queue_length,
+            },
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+def queue_headers(queue_position: Optional[int]) -> dict:
+    return {"X-Queue-Position": str(queue_position)} if queue_position is not None else {}
+
+@app.post("/api/chat", response_model=ChatResponse, dependencies=[Depends(require_rag_ready)])
+async def chat_endpoint(request: ChatRequest, response: Response, current_user: User = Depends(get_current_user)):
     # Simulate processing delay related to AI
     # time.sleep(1) # Removed artificial delay as RAG takes time
     
@@ -68,19 +248,63 @@ async def chat_endpoint(request: ChatRequest, current_user: User = Depends(get_c
     subject = request.subject
     
     # Use RAG Service to get answer
-    response_text = rag_service.get_answer(user_msg)
+    response.headers.update(queue_headers(await check_llm_capacity(user_msg, current_user.id)))
+    response_text = await rag_service.aget_answer(user_msg, user=current_user.id)
 
     return ChatResponse(response=response_text)
 
-@app.post("/api/chat/stream")
-async def chat_stream_endpoint(request: ChatRequest, current_user: User = Depends(get_current_user)):
+@app.post("/api/chat/stream", dependencies=[Depends(require_rag_ready)])
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request, format: str = "text", current_user: User = Depends(get_current_user)):
     user_msg = request.message
-    
+    headers = queue_headers(await check_llm_capacity(user_msg, current_user.id, coalesce=True))
+    # Generation stops as soon as the client goes away (tab closed, navigation)
+    answer = rag_service.astream_answer(user_msg, user=current_user.id)
+
+    if format == "sse":
+        # Server-Sent Events with heartbeats, for clients behind proxies that drop idle connections
+        return StreamingResponse(
+            sse_stream(http_request, answer),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **headers},
+        )
+
     return StreamingResponse(
-        rag_service.stream_answer(user_msg), 
-        media_type="text/plain"
+        text_stream(http_request, answer), 
+        media_type="text/plain",
+        headers={"X-Accel-Buffering": "no", **headers},
     )
 
+@app.delete("/api/chat/history", status_code=204)
+async def clear_chat_history(current_user: User = Depends(get_current_user)):
+    # "New conversation": the next question starts without history
+    rag_service.conversations.forget(current_user.id)
+    return Response(status_code=204)
+
+@app.post("/api/chat/speak", dependencies=[Depends(require_rag_ready)])
+async def chat_speak_endpoint(request: ChatRequest, format: str = "mp3", current_user: User = Depends(get_current_user)):
+    await check_llm_capacity(request.message, current_user.id, coalesce=True)
+    # Answer read aloud sentence by sentence while the LLM is still generating
+    speech = stream_speech(
+        rag_service.astream_answer(request.message, user=current_user.id),
+        tts_service.get_clip_bytes,
+        tts_service.executor,
+    )
+
+    if format == "ndjson":
+        # One JSON line per sentence: text plus base64 MP3, for clients that also render the text
+        async def ndjson_lines():
+            index = 0
+            async for sentence, audio in speech:
+                yield json.dumps({"index": index, "text": sentence, "audio": base64.b64encode(audio).decode("ascii")}) + "\n"
+                index += 1
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    # MP3 frames can be concatenated, so segments play back as one stream
+    async def audio_segments():
+        async for _, audio in speech:
+            yield audio
+    return StreamingResponse(audio_segments(), media_type="audio/mpeg")
+
 from auth_service import auth_service, get_current_user, Token
 from models import User
 from fastapi.security import OAuth2PasswordRequestForm
@@ -92,21 +316,23 @@ class UserCreate(BaseModel):
     password: str
 
 @app.post("/api/auth/register", response_model=Token)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if username exists
-    if auth_service.get_user(db, user.username):
+    if await auth_service.get_user(db, user.username):
          raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     # Check if email exists
-    if auth_service.get_user(db, user.email):
+    if await auth_service.get_user(db, user.email):
          raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
 
-    new_user = auth_service.create_user(db, user.username, user.email, user.password)
+    # bcrypt runs on the hashing pool, never on the event loop
+    hashed_password = await auth_service.aget_password_hash(user.password)
+    new_user = await auth_service.create_user(db, user.username, user.email, user.password, hashed_password=hashed_password)
     if not new_user:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -116,10 +342,10 @@ async def register(user: UserCreate, db: Session = Depends(get_db)):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/api/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     # form_data.username can be username OR email
-    user = auth_service.get_user(db, form_data.username)
-    if not user or not auth_service.verify_password(form_data.password, user.password_hash):
+    user = await auth_service.get_user(db, form_data.username)
+    if not user or not await auth_service.averify_password(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username/email or password",
@@ -128,32 +354,95 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     access_token = auth_service.create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.get("/api/auth/hash-stats")
+def password_hash_stats():
+    return auth_service.hash_pool.stats()
+
 class PostCreate(BaseModel):
     content: str
 
 @app.get("/api/community/posts")
-def get_posts(db: Session = Depends(get_db)):
-    return community_service.get_posts(db)
+async def get_posts(http_request: Request, limit: int = FEED_PAGE_SIZE, cursor: str | None = None, db: AsyncSession = Depends(get_async_db)):
+    # Body stays a plain list for existing clients; the next page cursor goes in a header
+    try:
+        page = await community_service.get_feed_page(db, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    headers = {"ETag": page.etag, "Cache-Control": "no-cache"}
+    if page.next_cursor:
+        headers["X-Next-Cursor"] = page.next_cursor
+    if http_request.headers.get("if-none-match") == page.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(page.body, media_type="application/json", headers=headers)
 
 @app.post("/api/community/posts")
-def create_post(post: PostCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_post(post: PostCreate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     # Use the authenticated user's ID
-    return community_service.create_post(db, current_user.id, post.content)
+    return await community_service.create_post(db, current_user.id, post.content)
 
 @app.post("/api/community/posts/{post_id}/like")
-def like_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    updated_post = community_service.like_post(db, post_id)
+async def like_post(post_id: int, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    updated_post = await community_service.like_post(db, post_id)
     if not updated_post:
         raise HTTPException(status_code=404, detail="Post not found")
     return updated_post
 
+def _byte_range(range_header: str, size: int):
+    """Parses a single "bytes=start-end" range. Returns (start, end) inclusive or None."""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_str, _, end_str = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = min(int(end_str), size - 1) if end_str else size - 1
+        else:
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        return None
+    return start, end
+
+def _audio_response(http_request: Request, clip):
+    key, data = clip
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        # Clips are content-addressed, so the browser may keep them
+        "Cache-Control": "public, max-age=604800",
+        "Accept-Ranges": "bytes",
+        "Content-Location": f"/api/tts/audio/{key}",
+    }
+    if http_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = _byte_range(http_request.headers.get("range"), len(data))
+    if byte_range is not None:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start:end + 1], status_code=206, media_type="audio/mpeg", headers=headers)
+    return Response(data, media_type="audio/mpeg", headers=headers)
+
 @app.post("/api/tts")
-def tts_endpoint(request: TTSRequest):
-    audio_buffer = tts_service.generate_audio(request.text)
-    if not audio_buffer:
+def tts_endpoint(request: TTSRequest, http_request: Request):
+    clip = tts_service.get_clip(request.text)
+    if not clip:
         raise HTTPException(status_code=500, detail="TTS Generation failed")
     
-    return StreamingResponse(audio_buffer, media_type="audio/mpeg")
+    return _audio_response(http_request, clip)
+
+@app.get("/api/tts/audio/{clip_id}")
+def tts_audio_endpoint(clip_id: str, http_request: Request):
+    # Cacheable GET for clips already synthesized via POST /api/tts
+    if not re.fullmatch(r"[0-9a-f]{64}", clip_id):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    clip = tts_service.get_cached_clip(clip_id)
+    if not clip:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return _audio_response(http_request, clip)
 
 if __name__ == "__main__":
     import uvicorn
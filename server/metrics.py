@@ -0,0 +1,289 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Per-request trace lines on stdout (stage timings of every answer)
+TRACE_LOG = os.getenv("RAG_TRACE_LOG", "false").lower() == "true"
+
+# Seconds. Covers cache hits (ms) up to slow CPU-only generations (a minute)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels. inc() is a dict update under a lock."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus layout."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the metrics and renders the Prometheus text exposition format.
+
+    Collectors are callables invoked at scrape time that return
+    (name, type, help, [(labels dict, value), ...]) tuples; they expose
+    counters the services already keep (cache stats and the like).
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple]]):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- RAG ---
+RAG_STAGE_SECONDS = REGISTRY.histogram(
+    "tomi_rag_stage_seconds", "Time spent per answer stage (embed, rewrite, retrieve, prompt, ttft, generate, llm, total); ttft and llm include the provider queue.", ("provider", "path", "stage"))
+RAG_ANSWERS = REGISTRY.counter(
+    "tomi_rag_answers_total", "Answers by outcome (llm, cache_hit, intent, error, cancelled, busy, not_ready, no_documents).", ("provider", "path", "outcome"))
+COALESCED_STREAMS = REGISTRY.counter(
+    "tomi_rag_coalesced_streams_total", "Stream requests that joined an identical in-flight generation instead of starting one.")
+INTENT_ROUTES = REGISTRY.counter(
+    "tomi_intent_routes_total", "Queries answered by the intent router (no retrieval, no LLM), by intent.", ("intent",))
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "tomi_rag_context_tokens", "Estimated prompt context tokens after packing (retrieved text plus conversation history).", ("provider",), buckets=(100, 250, 500, 1000, 2000, 4000, 8000))
+CONTEXT_DUPLICATES = REGISTRY.counter(
+    "tomi_rag_context_duplicates_total", "Retrieved chunks dropped as near-duplicates.", ("provider",))
+LLM_OUTPUT_TOKENS = REGISTRY.counter(
+    "tomi_llm_output_tokens_total", "Generated tokens (provider usage when reported, else streamed chunks).", ("provider",))
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "tomi_llm_tokens_per_second", "Generation speed after the first token.", ("provider",), buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 200))
+
+# --- PROVIDERS ---
+PROVIDER_REQUESTS = REGISTRY.counter(
+    "tomi_provider_requests_total", "LLM requests by provider and result (success, error, rate_limited, cancelled).", ("provider", "result"))
+PROVIDER_TTFT_SECONDS = REGISTRY.histogram(
+    "tomi_provider_ttft_seconds", "Time to first token per provider, as seen by the router.", ("provider",))
+PROVIDER_HEDGES = REGISTRY.counter(
+    "tomi_provider_hedges_total", "Backup requests started because the first token was late, by backup provider.", ("provider",))
+PROVIDER_FAILOVERS = REGISTRY.counter(
+    "tomi_provider_failovers_total", "Retries on another provider after a failure before the first token.", ("provider",))
+
+LLM_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "tomi_llm_queue_wait_seconds", "Time a generation waited for a provider slot.", ("provider",))
+LLM_SHED = REGISTRY.counter(
+    "tomi_llm_shed_total", "Generations turned away because the provider's wait queue was full.", ("provider",))
+
+# --- STREAMING ---
+STREAM_CHUNKS = REGISTRY.counter("tomi_stream_chunks_total", "Answer chunks produced for streamed responses.")
+STREAM_WRITES = REGISTRY.counter("tomi_stream_writes_total", "Body writes of streamed responses after batching, by format.", ("format",))
+STREAM_DISCONNECTS = REGISTRY.counter("tomi_stream_disconnects_total", "Streams stopped because the client went away before the end.")
+
+# --- INGESTION ---
+INGEST_STAGE_SECONDS = REGISTRY.histogram(
+    "tomi_ingest_stage_seconds", "Time per ingestion stage (load, hash, parse, embed, persist, total).", ("stage",),
+    buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+INGEST_FILES = REGISTRY.counter("tomi_ingest_files_total", "Files processed by ingestion, by result.", ("result",))
+INGEST_CHUNKS = REGISTRY.counter("tomi_ingest_chunks_total", "Chunks embedded into the index.")
+INDEX_RELOADS = REGISTRY.counter("tomi_index_reloads_total", "Hot index reloads (watcher or admin endpoint), by result.", ("result",))
+
+# --- TTS ---
+TTS_SECONDS = REGISTRY.histogram("tomi_tts_seconds", "Time to return a clip, by cache result.", ("result",))
+TTS_SYNTHESIS_SECONDS = REGISTRY.histogram("tomi_tts_synthesis_seconds", "gTTS synthesis time (cache misses only).")
+
+# --- DATABASE ---
+DB_QUERY_SECONDS = REGISTRY.histogram("tomi_db_query_seconds", "Statement execution time.", ("engine", "statement"))
+DB_ERRORS = REGISTRY.counter("tomi_db_errors_total", "Failed statements.", ("engine",))
+
+# --- ERRORS ---
+ERRORS = REGISTRY.counter("tomi_errors_total", "Handled errors by component.", ("component", "provider"))
+
+
+class RequestTrace:
+    """Stage timings of one answer, recorded into the RAG histograms.
+
+    Cheap enough to always run: a few perf_counter() calls and dict updates
+    per request. With RAG_TRACE_LOG=true, finish() also prints one line.
+    """
+
+    def __init__(self, provider: str, path: str):
+        self.provider = provider
+        self.path = path
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.tokens = 0
+        self._finished = False
+        self._generation_started = None
+        self._first_token = None
+        self._chunks = 0
+        self._usage_tokens = 0
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = seconds
+        RAG_STAGE_SECONDS.observe(seconds, provider=self.provider, path=self.path, stage=name)
+
+    # --- LLM streaming: time to first token, generation time, tokens ---
+
+    def start_generation(self):
+        self._generation_started = time.perf_counter()
+
+    def on_chunk(self, chunk):
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+            self.record("ttft", self._first_token - self._generation_started)
+        self._chunks += 1
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self._usage_tokens += usage.get("output_tokens", 0)
+
+    def end_generation(self):
+        if self._first_token is None:
+            return
+        seconds = time.perf_counter() - self._first_token
+        self.record("generate", seconds)
+        tokens = self._usage_tokens or self._chunks
+        self.tokens += tokens
+        LLM_OUTPUT_TOKENS.inc(tokens, provider=self.provider)
+        if tokens > 1 and seconds > 0:
+            LLM_TOKENS_PER_SECOND.observe((tokens - 1) / seconds, provider=self.provider)
+
+    def finish(self, outcome: str):
+        if self._finished:
+            return
+        self._finished = True
+        self.record("total", time.perf_counter() - self.started)
+        RAG_ANSWERS.inc(provider=self.provider, path=self.path, outcome=outcome)
+        if outcome == "error":
+            ERRORS.inc(component="rag", provider=self.provider)
+        if TRACE_LOG:
+            stages = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items())
+            print(f"[trace] provider={self.provider} path={self.path} outcome={outcome} tokens={self.tokens} {stages}")
+
+
+def instrument_engine(engine, name: str):
+    """Times every statement on a SQLAlchemy engine (pass async_engine.sync_engine for async)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["metrics_start"].pop()
+        verb = statement.lstrip().split(None, 1)[0].lower() if statement else "other"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, engine=name, statement=verb)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("metrics_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+        DB_ERRORS.inc(engine=name)
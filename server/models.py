@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -24,3 +24,15 @@ class Post(Base):
     author_id = Column(Integer, ForeignKey("users.id"))
 
     author = relationship("User", back_populates="posts")
+
+    # Keyset pagination of the feed walks (timestamp, id) in descending order
+    __table_args__ = (Index("ix_posts_timestamp_id", "timestamp", "id"),)
+
+class Conversation(Base):
+    """Chat memory of users whose conversation was evicted from memory (see conversation_memory.py)."""
+    __tablename__ = "conversations"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="[]")  # JSON list of summary lines
+    turns = Column(Text, nullable=False, default="[]")    # JSON list of the verbatim turns
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
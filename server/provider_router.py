@@ -0,0 +1,311 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import aclosing
+from typing import Callable, Dict, Iterator, List
+
+from llm_scheduler import FairScheduler, SchedulerBusy
+from metrics import PROVIDER_REQUESTS, PROVIDER_TTFT_SECONDS, PROVIDER_HEDGES, PROVIDER_FAILOVERS
+
+# Expected time to first token before any sample exists (seconds)
+DEFAULT_TTFT_PRIOR = {
+    "ollama": 3.0,
+    "gemini": 1.0,
+    "deepseek": 1.5,
+}
+# Start a backup provider when the first token takes longer than this (0 = no hedging)
+PROVIDER_HEDGE_AFTER_MS = float(os.getenv("PROVIDER_HEDGE_AFTER_MS", "0"))
+# Ping idle local providers this often so the model stays loaded (0 = never)
+PROVIDER_KEEPALIVE_SECONDS = float(os.getenv("PROVIDER_KEEPALIVE_SECONDS", "240"))
+# Providers that need the keep-alive ping (cloud APIs have no cold start)
+KEEP_WARM_PROVIDERS = {"ollama"}
+WARMUP_PROMPT = "Respondé solamente: ok"
+# Lane of the keep-warm pings in the providers' fair queues
+KEEP_WARM_USER = "keep-warm"
+
+
+def configured_providers(primary: str) -> List[str]:
+    """AI_PROVIDERS="gemini,deepseek,ollama" enables several; the primary always comes first."""
+    names = [p.strip().lower() for p in os.getenv("AI_PROVIDERS", "").split(",") if p.strip()]
+    return [primary] + [p for p in dict.fromkeys(names) if p != primary]
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}"
+    return "429" in text or "RateLimit" in text or "RESOURCE_EXHAUSTED" in text or "quota" in text.lower()
+
+
+class ProviderHealth:
+    """Rolling view of one provider: EWMA of time to first token and error rate, plus a cooldown."""
+
+    def __init__(self, name: str, alpha: float = 0.2):
+        self.name = name
+        self.alpha = alpha
+        self.ttft = DEFAULT_TTFT_PRIOR.get(name, 2.0)
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        self.samples = 0
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self, busy: bool) -> float:
+        # Lower is better: slow or failing providers sink, saturated ones wait their turn
+        return self.ttft * (1 + 4 * self.error_rate) * (2 if busy else 1)
+
+    def record_ttft(self, seconds: float):
+        self.ttft = seconds if self.samples == 0 else (1 - self.alpha) * self.ttft + self.alpha * seconds
+        self.samples += 1
+
+    def record_success(self):
+        self.error_rate *= (1 - self.alpha)
+        self.consecutive_failures = 0
+        self.last_used = time.monotonic()
+
+    def record_failure(self, error: Exception):
+        self.error_rate = (1 - self.alpha) * self.error_rate + self.alpha
+        self.consecutive_failures += 1
+        self.last_used = time.monotonic()
+        # Back off 5s, 10s, 20s... up to a minute; rate limits start at 30s
+        base = 30.0 if _is_rate_limit(error) else 5.0
+        self.cooldown_until = time.monotonic() + min(base * 2 ** (self.consecutive_failures - 1), 60.0)
+
+
+class ProviderRouter:
+    """Sends each generation to the fastest healthy provider.
+
+    Providers are ranked by their rolling time to first token, inflated by
+    recent errors and by a full concurrency limit; providers in cooldown
+    after a failure, or with a full wait queue, go last. If the chosen
+    provider fails before its first token the next one is tried. With
+    hedging enabled, a backup request starts when the first token is late
+    (queue time included), and the slower one is cancelled.
+    """
+
+    def __init__(self, llms: Dict[str, object], scheduler_for: Callable[[str], FairScheduler], hedge_after: float = 0.0, keepalive: float = 0.0):
+        self.llms = llms
+        self.scheduler_for = scheduler_for
+        self.hedge_after = hedge_after
+        self.keepalive = keepalive
+        self.health = {name: ProviderHealth(name) for name in llms}
+        self._keep_warm_thread = None
+        self._loop = None  # event loop the schedulers live on
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls, llms: Dict[str, object], scheduler_for):
+        return cls(llms, scheduler_for, hedge_after=PROVIDER_HEDGE_AFTER_MS / 1000, keepalive=PROVIDER_KEEPALIVE_SECONDS)
+
+    def ranked(self) -> List[str]:
+        now = time.monotonic()
+
+        def key(name):
+            health = self.health[name]
+            scheduler = self.scheduler_for(name)
+            return (
+                not health.healthy(now) or not scheduler.can_admit(),
+                health.cooldown_until if not health.healthy(now) else 0.0,
+                health.score(scheduler.locked()),
+            )
+
+        return sorted(self.llms, key=key)
+
+    def admit(self, user=None) -> int:
+        """Early admission check: queue position on the provider a request would
+        most likely get, or SchedulerBusy when every provider's queue is full."""
+        schedulers = [self.scheduler_for(name) for name in self.ranked()]
+        for scheduler in schedulers:
+            if scheduler.can_admit(user):
+                return scheduler.position(user)
+        raise min((s.busy_error() for s in schedulers), key=lambda e: e.retry_after)
+
+    def _record_failure(self, name: str, error: Exception):
+        self.health[name].record_failure(error)
+        PROVIDER_REQUESTS.inc(provider=name, result="rate_limited" if _is_rate_limit(error) else "error")
+        print(f"Provider {name} failed: {error}")
+
+    def _record_first_token(self, name: str, seconds: float):
+        self.health[name].record_ttft(seconds)
+        PROVIDER_TTFT_SECONDS.observe(seconds, provider=name)
+
+    # --- ASYNC (API endpoints) ---
+
+    async def _attempt(self, name: str, prompt: str, user, queue: asyncio.Queue):
+        try:
+            async with self.scheduler_for(name).slot(user):
+                await queue.put(("started", name, time.monotonic()))
+                try:
+                    async for chunk in self.llms[name].astream(prompt):
+                        await queue.put(("chunk", name, chunk))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await queue.put(("error", name, e))
+                    return
+                await queue.put(("done", name, None))
+        except SchedulerBusy as e:
+            await queue.put(("busy", name, e))
+
+    async def astream(self, prompt_for: Callable[[str], str], user=None):
+        """Yields (provider, chunk). `prompt_for(provider)` builds that provider's prompt.
+
+        `user` picks the lane in the providers' fair queues.
+        """
+        pending = self.ranked()
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[str, asyncio.Task] = {}
+        started: Dict[str, float] = {}
+        winner = None
+        finished = False
+        busy: List[SchedulerBusy] = []
+        next_hedge_at = None
+
+        def launch(name):
+            nonlocal next_hedge_at
+            tasks[name] = asyncio.create_task(self._attempt(name, prompt_for(name), user, queue))
+            next_hedge_at = time.monotonic() + self.hedge_after if self.hedge_after else None
+
+        launch(pending.pop(0))
+        try:
+            while True:
+                timeout = None
+                if winner is None and pending and next_hedge_at is not None:
+                    timeout = max(0.0, next_hedge_at - time.monotonic())
+                try:
+                    kind, name, payload = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    # First token is late: race a backup provider
+                    backup = pending.pop(0)
+                    PROVIDER_HEDGES.inc(provider=backup)
+                    launch(backup)
+                    continue
+
+                if winner is not None and name != winner:
+                    continue  # leftovers from a cancelled attempt
+                if kind == "started":
+                    started[name] = payload
+                elif kind == "chunk":
+                    if winner is None:
+                        winner = name
+                        self._record_first_token(name, time.monotonic() - started[name])
+                        for other, task in tasks.items():
+                            if other != name:
+                                task.cancel()
+                                PROVIDER_REQUESTS.inc(provider=other, result="cancelled")
+                                if other in started:
+                                    # Lower bound of its TTFT: it lost the race
+                                    self._record_first_token(other, time.monotonic() - started[other])
+                    yield name, payload
+                elif kind == "done":
+                    finished = True
+                    self.health[name].record_success()
+                    PROVIDER_REQUESTS.inc(provider=name, result="success")
+                    return
+                elif kind in ("error", "busy"):
+                    tasks.pop(name, None)
+                    if kind == "busy":
+                        # A full queue is not a failure: no cooldown, just try elsewhere
+                        busy.append(payload)
+                    else:
+                        self._record_failure(name, payload)
+                        if winner is not None:
+                            raise payload  # mid-answer: the text already sent cannot be replayed
+                    if tasks:
+                        continue  # a hedged attempt is still running
+                    if not pending:
+                        raise min(busy, key=lambda e: e.retry_after) if kind == "busy" else payload
+                    fallback = pending.pop(0)
+                    PROVIDER_FAILOVERS.inc(provider=fallback)
+                    launch(fallback)
+        finally:
+            for name, task in tasks.items():
+                if not finished and not task.done() and winner in (None, name):
+                    # Abandoned mid-request (client gone); losers were counted when the winner was picked
+                    PROVIDER_REQUESTS.inc(provider=name, result="cancelled")
+                task.cancel()
+
+    # --- SYNC (scripts, tools) ---
+
+    def stream(self, prompt_for: Callable[[str], str]) -> Iterator[tuple]:
+        """Sync counterpart of astream: fails over before the first token, no hedging."""
+        candidates = self.ranked()
+        for index, name in enumerate(candidates):
+            started = time.monotonic()
+            first = True
+            try:
+                for chunk in self.llms[name].stream(prompt_for(name)):
+                    if first:
+                        self._record_first_token(name, time.monotonic() - started)
+                        first = False
+                    yield name, chunk
+            except Exception as e:
+                self._record_failure(name, e)
+                if not first or index == len(candidates) - 1:
+                    raise
+                PROVIDER_FAILOVERS.inc(provider=candidates[index + 1])
+                continue
+            self.health[name].record_success()
+            PROVIDER_REQUESTS.inc(provider=name, result="success")
+            return
+
+    # --- KEEP WARM ---
+
+    async def _aping(self, name: str):
+        try:
+            async with self.scheduler_for(name).slot(KEEP_WARM_USER):
+                started = time.monotonic()
+                # The first token is all a TTFT sample needs (and enough to load the model)
+                async with aclosing(self.llms[name].astream(WARMUP_PROMPT)) as chunks:
+                    async for _ in chunks:
+                        self._record_first_token(name, time.monotonic() - started)
+                        break
+        except SchedulerBusy:
+            return  # busy answering questions, so already warm
+        except Exception as e:
+            self._record_failure(name, e)
+            return
+        self.health[name].record_success()
+
+    def _ping(self, name: str):
+        # The schedulers are not thread-safe: run on their loop when the API is serving
+        if self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._aping(name), self._loop).result()
+        else:
+            asyncio.run(self._aping(name))
+
+    def _keep_warm(self):
+        # Load Ollama's model before the first question; cloud APIs have no cold start
+        # and keep their TTFT priors until real traffic measures them
+        for name in self.llms:
+            if name in KEEP_WARM_PROVIDERS:
+                self._ping(name)
+        while self.keepalive and not self._stop.wait(self.keepalive):
+            now = time.monotonic()
+            for name in self.llms:
+                if name in KEEP_WARM_PROVIDERS and now - self.health[name].last_used >= self.keepalive:
+                    self._ping(name)
+
+    def start_keep_warm(self, loop: asyncio.AbstractEventLoop = None):
+        """`loop` is the API's event loop; pings share the providers' queues with requests on it."""
+        if self._keep_warm_thread is None:
+            self._loop = loop
+            self._keep_warm_thread = threading.Thread(target=self._keep_warm, name="provider-keep-warm", daemon=True)
+            self._keep_warm_thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "ttft_ewma_ms": round(h.ttft * 1000, 1),
+                "error_rate": round(h.error_rate, 4),
+                "healthy": h.healthy(now),
+                "cooldown_seconds": round(max(0.0, h.cooldown_until - now), 1),
+            }
+            for name, h in self.health.items()
+        }
@@ -0,0 +1,160 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class QueryEmbedder(Embeddings):
+    """Query-embedding front end for the local sentence-transformer.
+
+    Concurrent queries are gathered for up to `max_wait_ms` (or until
+    `batch_size` are waiting) and embedded in a single forward pass by one
+    worker thread. Results are kept in a bounded LRU keyed by the normalized
+    query. Document embedding (ingestion) goes straight to the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, batch_size: int = 32, max_wait_ms: float = 5, cache_size: int = 2048):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches = 0
+        self.batched_queries = 0
+
+    @classmethod
+    def from_env(cls, embeddings: Embeddings):
+        return cls(
+            embeddings,
+            batch_size=int(os.getenv("QUERY_EMBED_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("QUERY_EMBED_MAX_WAIT_MS", "5")),
+            cache_size=int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2048")),
+        )
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # all-MiniLM-L6-v2 is uncased, so lowercasing does not change the vector
+        return " ".join(text.lower().split())
+
+    # --- CACHE ---
+
+    def _cache_get(self, key: str):
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is None:
+                self.cache_misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return vector
+
+    def _cache_put(self, key: str, vector: List[float]):
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- BATCHING WORKER ---
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                # This is the only worker: it must survive anything a batch throws
+                print(f"Query embedding batch failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed_batch(self, batch):
+        # Callers that were cancelled while waiting (client gone) are dropped here
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = list(dict.fromkeys(text for text, _ in batch))  # dedupe, keep order
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.batched_queries += len(batch)
+        by_text = dict(zip(texts, vectors))
+        for text, vector in by_text.items():
+            self._cache_put(text, vector)
+        for text, future in batch:
+            future.set_result(by_text[text])
+
+    def _submit(self, key: str) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((key, future))
+        return future
+
+    # --- EMBEDDINGS INTERFACE ---
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self.normalize(text)
+        vector = self._cache_get(key)
+        if vector is not None:
+            return vector
+        return self._submit(key).result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self.normalize(text)
+        vector = self._cache_get(key)
+        if vector is not None:
+            return vector
+        return await asyncio.wrap_future(self._submit(key))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            "batches": self.batches,
+            "batched_queries": self.batched_queries,
+            "avg_batch_fill": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+            "batch_size": self.batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -1,20 +1,43 @@
 import os
+import re
 import time
-import gc
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.chat_models import ChatOllama
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+import asyncio
+import threading
+from contextlib import aclosing
+from typing import Optional
 from langchain.docstore.document import Document
-from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+from answer_cache import SemanticAnswerCache
+from ingest_pipeline import IngestManifest, file_sha256, chunk_ids, parse_files, EMBED_BATCH_SIZE, CHECKPOINT_EVERY_FILES, CHUNK_SIZE, CHUNK_OVERLAP
+from compact_store import has_compact_index, has_pickle_index, load_compact_store, save_compact_store, convert_pickle_store
+from bm25_index import BM25Index
+from hybrid_retrieval import HybridRetriever
+from query_embedder import QueryEmbedder
+from intent_router import IntentRouter, IntentMatch, normalize
+from context_builder import ContextBuilder, CONTEXT_CANDIDATES
+from provider_router import ProviderRouter, configured_providers
+from single_flight import StreamCoalescer
+from stream_transport import ErrorText
+from conversation_memory import ConversationMemory, FollowUp
+from llm_scheduler import FairScheduler, SchedulerBusy
+from metrics import RequestTrace, INTENT_ROUTES, CONTEXT_TOKENS, CONTEXT_DUPLICATES, INGEST_STAGE_SECONDS, INGEST_FILES, INGEST_CHUNKS, INDEX_RELOADS, ERRORS
+from index_store import (
+    EMBEDDING_MODEL, MANIFEST_FILENAME, LEGACY_PROCESSED_FILENAME, shared_index_path, migrate_legacy_index, remove_legacy_indexes,
+    current_generation_path, new_generation_path, publish_generation, remove_old_generations,
+)
 
 # Load environment variables
 load_dotenv()
 
+# Typing effect when replaying canned answers on the async stream (0 = all at once)
+CANNED_REPLAY_DELAY_MS = float(os.getenv("CANNED_REPLAY_DELAY_MS", "50"))
+
+# Identical questions streamed at the same time share one generation
+STREAM_COALESCING = os.getenv("STREAM_COALESCING", "true").lower() == "true"
+
+# Poll the data directory this often and reload the index when PDFs change (0 = off)
+INDEX_WATCH_SECONDS = float(os.getenv("INDEX_WATCH_SECONDS", "60"))
+
 class RAGService:
     _instance = None
 
@@ -31,159 +54,484 @@ class RAGService:
         print(f"Active Provider: {self.provider.upper()}")
         
         self.vector_store = None
-        self.qa_chain = None
+        self.lexical_index = None
+        self.retriever = None
+        self.qa_prompt = None
+
+        # --- SEMANTIC ANSWER CACHE ---
+        # Repeated (or paraphrased) questions are answered without calling the LLM
+        self.answer_cache = SemanticAnswerCache.from_env()
+
+        # Per-provider concurrency limits and fair wait queues for the async path (created lazily)
+        self._llm_schedulers = {}
+        # Per-provider prompt context budgets (created lazily)
+        self._context_builders = {}
+        # In-flight async streams, keyed on provider + normalized question
+        self.coalescer = StreamCoalescer()
+
+        # --- CONVERSATION MEMORY ---
+        # Recent turns + rolling summary per user, for follow-up questions
+        self.conversations = ConversationMemory.from_env()
+
+        # Models are loaded by warm_up() in the background, not at import time
+        self.embeddings = None
+        self.query_embedder = None
+        self.llm = None
+        # All configured providers (AI_PROVIDERS) and the router that picks one per request
+        self.llms = {}
+        self.router = None
+        self.intent_router = None
+
+        # Readiness: "starting" -> "loading_models" -> "indexing" -> "ready" (or "failed")
+        self.ready = False
+        self.status = "starting"
+        self.warmup_error = None
+        self._warmup_thread = None
+
+        # --- HOT RELOAD ---
+        # One ingestion at a time (startup, watcher or admin endpoint)
+        self._ingest_lock = threading.Lock()
+        self.data_dir = None
+        self.generation_path = None  # index generation being served
+        self._indexed_signature = None
+        self.last_reload = None
+        self._watcher_thread = None
+        self._stop_watching = threading.Event()
+
+        # --- SHARED VECTOR STORE ---
+        # Keyed on embedding model + chunking, so switching AI_PROVIDER needs no re-embedding
+        self.index_path = shared_index_path(EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP)
 
+        print(f"Vector Store Path: {self.index_path}")
+        print(f"------------------------------------------")
+
+    def _load_models(self):
+        """Loads the embedding model and the LLM clients for the configured providers (once)."""
+        if self.embeddings is not None:
+            return
         # --- UNIVERSAL EMBEDDINGS (HuggingFace Local) ---
         # Optimized for CPU (Quantized/Small models like all-MiniLM-L6-v2)
+        from langchain_community.embeddings import HuggingFaceEmbeddings
         print("Initializing HuggingFace Embeddings (Local CPU)...")
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+        self.embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        # Chat queries go through a micro-batching, LRU-cached front end
+        self.query_embedder = QueryEmbedder.from_env(self.embeddings)
+        self.set_llms({provider: self._create_llm(provider) for provider in configured_providers(self.provider)})
+
+    def set_llms(self, llms: dict):
+        """Installs the LLM clients (primary provider first) and a router over them."""
+        self.llms = llms
+        self.llm = llms[self.provider]
+        self.router = ProviderRouter.from_env(llms, self._llm_scheduler)
+        if len(llms) > 1:
+            print(f"Provider routing across: {', '.join(llms)}")
 
-        if self.provider == "gemini":
+    def _create_llm(self, provider: str):
+        # Provider SDKs are imported here so only the configured ones are ever loaded
+        if provider == "gemini":
             # --- GEMINI CLOUD CONFIGURATION ---
+            from langchain_google_genai import ChatGoogleGenerativeAI
             api_key = os.getenv("GOOGLE_API_KEY")
             if not api_key:
                 print("CRITICAL ERROR: GOOGLE_API_KEY is missing for Gemini provider.")
-            
+
             print("Connecting to Google Gemini (Flash Lite)...")
-            self.llm = ChatGoogleGenerativeAI(
-                model="gemini-flash-lite-latest", 
+            return ChatGoogleGenerativeAI(
+                model="gemini-flash-lite-latest",
                 google_api_key=api_key,
                 temperature=0.3,
                 convert_system_message_to_human=True
             )
-            self.index_path = "faiss_index_gemini_local"
 
-        elif self.provider == "deepseek":
+        if provider == "deepseek":
             # --- DEEPSEEK API CONFIGURATION ---
+            from langchain_openai import ChatOpenAI
             api_key = os.getenv("DEEPSEEK_API_KEY")
             if not api_key:
                 print("CRITICAL ERROR: DEEPSEEK_API_KEY is missing.")
-            
+
             print("Connecting to DeepSeek API...")
-            self.llm = ChatOpenAI(
-                model="deepseek-chat", 
-                openai_api_key=api_key, 
+            return ChatOpenAI(
+                model="deepseek-chat",
+                openai_api_key=api_key,
                 openai_api_base="https://api.deepseek.com",
                 temperature=0.3
             )
-            self.index_path = "faiss_index_deepseek_local"
-
-        elif self.provider == "ollama":
-            # --- OLLAMA LOCAL CONFIGURATION ---
-            # Using Llama 3.2 (3B) - Best balance of Speed vs Intelligence
-            base_url = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
-            print(f"Connecting to Ollama at {base_url} with model llama3.2...")
-            self.llm = ChatOllama(
-                model="llama3.2",
-                base_url=base_url,
-                temperature=0.1, 
-                keep_alive="5m"
-            )
-            self.index_path = "faiss_index_ollama_local"
-        
-        else:
-             # Fallback
-             print(f"Warning: Unknown provider {self.provider}. Defaulting to Ollama settings.")
-             self.index_path = "faiss_index_ollama_local"
 
-        print(f"Vector Store Path: {self.index_path}")
-        print(f"------------------------------------------")
+        if provider != "ollama":
+            print(f"Warning: Unknown provider {provider}. Defaulting to Ollama settings.")
+
+        # --- OLLAMA LOCAL CONFIGURATION ---
+        # Using Llama 3.2 (3B) - Best balance of Speed vs Intelligence
+        from langchain_community.chat_models import ChatOllama
+        base_url = os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+        print(f"Connecting to Ollama at {base_url} with model llama3.2...")
+        return ChatOllama(
+            model="llama3.2",
+            base_url=base_url,
+            temperature=0.1,
+            keep_alive="5m"
+        )
 
-    def ingest_pdfs(self, directory_path: str):
-        """Loads all PDFs from the directory and creates a vector store incrementally."""
-        print(f"Checking for existing vector store at {self.index_path}...")
-        if os.path.exists(self.index_path):
+    def warm_up(self, directory_path: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Loads models and syncs the index. Failures are recorded, not raised.
+
+        `loop` is the API's event loop, where the LLM queues live.
+        """
+        self.data_dir = directory_path
+        try:
+            self.status = "loading_models"
+            self._load_models()
+            # Loads Ollama's model before the first question
+            self.router.start_keep_warm(loop)
+            self.status = "indexing"
+            self.ingest_pdfs(directory_path)
+            # Later changes to the PDFs are picked up without a restart
+            self.start_index_watcher()
+        except Exception as e:
+            self.status = "failed"
+            self.warmup_error = str(e)
+            print(f"RAG warm-up failed: {e}")
+
+    def start_warm_up(self, directory_path: str):
+        """Runs warm_up in a background thread so the API can serve health checks meanwhile."""
+        if self._warmup_thread is None:
             try:
-                self.vector_store = FAISS.load_local(self.index_path, self.embeddings, allow_dangerous_deserialization=True)
-                print("Loaded existing vector store from disk.")
-            except Exception as e:
-                print(f"Error loading existing index: {e}. Starting fresh.")
-                self.vector_store = None
-        else:
-             print("No existing vector store found. Starting fresh.")
-             self.vector_store = None
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            self._warmup_thread = threading.Thread(target=self.warm_up, args=(directory_path, loop), name="rag-warmup", daemon=True)
+            self._warmup_thread.start()
+
+    def ingest_pdfs(self, directory_path: str) -> bool:
+        """Syncs the vector store with the PDFs in the directory.
+
+        Staged pipeline: hash files against the manifest, parse/split changed
+        files in a process pool, embed in large batches, merge into the index
+        and persist at checkpoints instead of after every file.
+
+        Changes go into a new index generation while queries keep using the
+        one being served; the retriever is swapped when the new one is
+        complete. Returns True when the index changed.
+        """
+        self._load_models()
+        if self.intent_router is None:
+            self.intent_router = IntentRouter.from_env(self.embeddings)
+            self.intent_router.reload()
+        with self._ingest_lock:
+            return self._sync_index(directory_path)
+
+    def _sync_index(self, directory_path: str) -> bool:
+        from langchain_community.vectorstores import FAISS
+
+        ingest_started = time.perf_counter()
+        migrated = migrate_legacy_index(self.index_path, self.provider, directory_path, EMBEDDING_MODEL, (CHUNK_SIZE, CHUNK_OVERLAP))
+        serving_path = current_generation_path(self.index_path)
+        # Taken before hashing, so edits made while this run is going count as new changes.
+        # Recorded only once the run completes, so a failed reload is retried.
+        signature = self._data_signature(directory_path)
+
+        if serving_path != self.generation_path:
+            # Startup: serve the generation on disk right away, even if files changed since
+            vector_store = self._load_vector_store(serving_path, directory_path if migrated else None)
+            if vector_store is not None:
+                self._swap_index(vector_store, self._load_lexical_index(serving_path, vector_store), serving_path)
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - ingest_started, stage="load")
 
         if not os.path.exists(directory_path):
-             print(f"Directory {directory_path} does not exist.")
-             self._setup_qa_chain()
-             return
-
-        # Load processed files tracking
-        processed_files_path = os.path.join(directory_path, f"processed_files_{self.provider}.txt")
-        processed_files = set()
-        if os.path.exists(processed_files_path):
-            with open(processed_files_path, 'r') as f:
-                processed_files = set(f.read().splitlines())
-            print(f"Found {len(processed_files)} previously processed files.")
-
-        files = [f for f in os.listdir(directory_path) if f.endswith(".pdf")]
-        total_files = len(files)
-        print(f"Found {total_files} PDF files to process in total.")
-
-        for index, filename in enumerate(files):
-            if filename in processed_files:
-                print(f"Skipping {filename} (already processed).")
+            print(f"Directory {directory_path} does not exist.")
+            if not self.ready:
+                self._setup_qa_chain()
+            self._indexed_signature = signature
+            return False
+
+        # Load content-hash tracking (migrating the old filename list if needed)
+        has_index = has_compact_index(serving_path)
+        manifest = IngestManifest(os.path.join(serving_path, MANIFEST_FILENAME))
+        if not manifest.load():
+            legacy_path = os.path.join(serving_path, LEGACY_PROCESSED_FILENAME)
+            manifest.migrate_from_processed_list(legacy_path, directory_path, self.vector_store if has_index else None)
+        if not has_index and manifest.files:
+            print("Manifest found but index is missing. Re-ingesting everything.")
+            manifest.files = {}
+
+        files = sorted(f for f in os.listdir(directory_path) if f.endswith(".pdf"))
+        print(f"Found {len(files)} PDF files in total.")
+
+        # --- STAGE 1: Diff directory against manifest ---
+        hash_started = time.perf_counter()
+        current_hashes = {f: file_sha256(os.path.join(directory_path, f)) for f in files}
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - hash_started, stage="hash")
+        to_parse = [f for f in files if manifest.files.get(f, {}).get("sha256") != current_hashes[f]]
+        removed = [f for f in manifest.files if f not in current_hashes]
+        changed = [f for f in to_parse if f in manifest.files]
+        print(f"Ingest plan: {len(to_parse) - len(changed)} new, {len(changed)} changed, {len(removed)} removed.")
+
+        index_changed = False
+        vector_store, lexical_index = None, BM25Index()
+
+        if to_parse or removed:
+            # Private, writable copies of the served generation; the served ones are never touched
+            if has_index:
+                vector_store = load_compact_store(serving_path, self.embeddings, writable=True)
+                lexical_index = self._load_lexical_index(serving_path, vector_store)
+
+        def drop_chunks(filenames):
+            """Removes the indexed chunks of these files and forgets them in the manifest."""
+            nonlocal index_changed
+            stale_ids = [doc_id for f in filenames if f in manifest.files for doc_id in manifest.files.pop(f)["ids"]]
+            if stale_ids and vector_store is not None:
+                known_ids = set(vector_store.index_to_docstore_id.values())
+                stale_ids = [doc_id for doc_id in stale_ids if doc_id in known_ids]
+                if stale_ids:
+                    vector_store.delete(stale_ids)
+                    lexical_index.remove(stale_ids)
+                    index_changed = True
+
+        # Deleted files go now; an edited file keeps its old chunks until its new ones are in
+        drop_chunks(removed)
+        if removed:
+            INGEST_FILES.inc(len(removed), result="removed")
+        # Files that failed to parse or embed: they are retried on the next run
+        failures = 0
+
+        # --- STAGE 2/3: Parse in parallel, embed in batches, merge ---
+        pending = []   # (filename, docs) waiting for the next embedding batch
+        pending_chunks = 0
+        files_since_checkpoint = 0
+        embed_seconds = 0.0
+
+        def flush():
+            nonlocal vector_store, pending, pending_chunks, files_since_checkpoint, index_changed, embed_seconds, failures
+            if not pending:
+                return
+            texts, metadatas, ids = [], [], []
+            for filename, docs in pending:
+                texts.extend(doc.page_content for doc in docs)
+                metadatas.extend(doc.metadata for doc in docs)
+                ids.extend(chunk_ids(filename, current_hashes[filename], len(docs)))
+            embed_started = time.perf_counter()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                text_embeddings = list(zip(texts, vectors))
+                if vector_store is None:
+                    vector_store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+                else:
+                    vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                lexical_index.add(ids, texts)
+            except Exception as e:
+                # Files stay out of the manifest, so the next run retries them
+                print(f"Error embedding batch of {len(pending)} files: {e}")
+                INGEST_FILES.inc(len(pending), result="failed")
+                failures += len(pending)
+                ERRORS.inc(component="ingest", provider=self.provider)
+                pending, pending_chunks = [], 0
+                return
+            embed_seconds += time.perf_counter() - embed_started
+            INGEST_CHUNKS.inc(len(texts))
+            INGEST_FILES.inc(len(pending), result="embedded")
+
+            drop_chunks([filename for filename, _ in pending])
+            for filename, docs in pending:
+                manifest.files[filename] = {
+                    "sha256": current_hashes[filename],
+                    "ids": chunk_ids(filename, current_hashes[filename], len(docs)),
+                }
+                print(f"Embedded {filename} ({len(docs)} chunks).")
+            files_since_checkpoint += len(pending)
+            index_changed = True
+            pending, pending_chunks = [], 0
+
+            if files_since_checkpoint >= CHECKPOINT_EVERY_FILES:
+                # A restart resumes from here; this process keeps serving the old generation until the end
+                self._persist_index(vector_store, lexical_index, manifest)
+                files_since_checkpoint = 0
+
+        parse_paths = [os.path.join(directory_path, f) for f in to_parse]
+        parse_started = time.perf_counter()
+        for done, (file_path, docs, error) in enumerate(parse_files(parse_paths), start=1):
+            filename = os.path.basename(file_path)
+            print(f"Parsed file {done}/{len(parse_paths)}: {filename}")
+            if error:
+                print(f"Error processing {filename}: {error}. Skipping for now.")
+                INGEST_FILES.inc(result="failed")
+                ERRORS.inc(component="ingest", provider=self.provider)
+                failures += 1
+                continue
+            if not docs:
+                print(f"Warning: No text found in {filename}")
+                INGEST_FILES.inc(result="empty")
+                drop_chunks([filename])
+                manifest.files[filename] = {"sha256": current_hashes[filename], "ids": []}
                 continue
+            pending.append((filename, docs))
+            pending_chunks += len(docs)
+            if pending_chunks >= EMBED_BATCH_SIZE:
+                flush()
+        flush()
+        if parse_paths:
+            # Parsing and embedding interleave; parse time is the rest of the loop
+            INGEST_STAGE_SECONDS.observe(time.perf_counter() - parse_started - embed_seconds, stage="parse")
+            INGEST_STAGE_SECONDS.observe(embed_seconds, stage="embed")
 
-            file_path = os.path.join(directory_path, filename)
-            print(f"Processing file {index + 1}/{total_files}: {filename}...")
-            
-            # Retry loop
-            max_retries = 3
-            success = False
-            
-            for attempt in range(max_retries):
-                try:
-                    loader = PyPDFLoader(file_path)
-                    docs = loader.load_and_split()
-                    
-                    if not docs:
-                        print(f"Warning: No text found in {filename}")
-                        success = True
-                        break
-
-                    # Add to Vector Store
-                    if self.vector_store is None:
-                        self.vector_store = FAISS.from_documents(docs, self.embeddings)
-                    else:
-                        self.vector_store.add_documents(docs)
-                    
-                    # Save progress
-                    self.vector_store.save_local(self.index_path)
-                    
-                    # Mark as processed
-                    with open(processed_files_path, 'a') as f:
-                        f.write(filename + "\n")
-                    
-                    print(f"Successfully embedded and saved {filename}.")
-                    success = True
-                    
-                    # Cleanup
-                    del docs
-                    del loader
-                    gc.collect()
-                    time.sleep(1) # Brief pause
-                    break 
-
-                except Exception as e:
-                    error_str = str(e)
-                    print(f"Error processing {filename} (Attempt {attempt+1}): {error_str}")
-                    if "429" in error_str:
-                        time.sleep(30)
-                    else:
-                        time.sleep(5)
-            
-            if not success:
-               print(f"Failed to process {filename} after all retries. Skipping for now.")
+        # --- STAGE 4: Persist once per run, then swap ---
+        if index_changed:
+            new_path = self._persist_index(vector_store, lexical_index, manifest)
+            # Serve from the memory-mapped files of the new generation
+            self._swap_index(load_compact_store(new_path, self.embeddings), lexical_index, new_path)
+            # Cached answers were generated from the previous index. Cleared after the swap:
+            # answers retrieved before it carry the old cache generation and are not stored
+            print("Index changed. Invalidating answer cache.")
+            self.answer_cache.clear()
+        else:
+            manifest.path = os.path.join(serving_path, MANIFEST_FILENAME)
+            manifest.save()
+            if self.vector_store is None:
+                print("Vectors store is empty after processing. Creating dummy store to prevent crash.")
+                dummy = FAISS.from_documents([Document(page_content="No context available.", metadata={"source": "none"})], self.embeddings)
+                self._swap_index(dummy, BM25Index(), serving_path)
 
-        # Final setup logic
-        if self.vector_store is None:
-             print("Vectors store is empty after processing. Creating dummy store to prevent crash.")
-             self.vector_store = FAISS.from_documents([Document(page_content="No context available.", metadata={"source": "none"})], self.embeddings)
-        
+        # Older generations (and unfinished ones from interrupted runs) are no longer needed
+        if remove_old_generations(self.index_path, current_generation_path(self.index_path)):
+            print("Removed old index generations.")
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - ingest_started, stage="total")
+        if failures:
+            # Leave the signature alone so the watcher tries the failed files again
+            print(f"{failures} files failed; they will be retried on the next reload.")
+        else:
+            self._indexed_signature = signature
+        return index_changed
+
+    def _load_vector_store(self, path: str, migrated_from: Optional[str] = None):
+        """Opens the generation at `path` read-only, or None if it holds no index."""
+        print(f"Checking for existing vector store at {path}...")
+        try:
+            if has_pickle_index(path) and not has_compact_index(path):
+                convert_pickle_store(path, self.embeddings)
+            if has_compact_index(path):
+                # Memory-mapped and lazily read: cheap to open in every worker
+                vector_store = load_compact_store(path, self.embeddings)
+                print("Loaded existing vector store from disk (memory-mapped).")
+                if migrated_from:
+                    remove_legacy_indexes(migrated_from)
+                return vector_store
+            print("No existing vector store found. Starting fresh.")
+        except Exception as e:
+            print(f"Error loading existing index: {e}. Starting fresh.")
+        return None
+
+    def _load_lexical_index(self, path: str, vector_store) -> BM25Index:
+        """Loads the BM25 index stored next to the vectors, building it if missing."""
+        if vector_store is None:
+            return BM25Index()
+        if BM25Index.exists(path):
+            try:
+                return BM25Index.load(path)
+            except Exception as e:
+                print(f"Error loading lexical index: {e}. Rebuilding.")
+
+        print("Building lexical (BM25) index from the vector store...")
+        lexical_index = BM25Index()
+        ids = list(vector_store.index_to_docstore_id.values())
+        docs = [vector_store.docstore.search(doc_id) for doc_id in ids]
+        lexical_index.add(ids, [doc.page_content if isinstance(doc, Document) else "" for doc in docs])
+        lexical_index.save(path)
+        return lexical_index
+
+    def _persist_index(self, vector_store, lexical_index: BM25Index, manifest: IngestManifest) -> str:
+        """Saves a checkpoint as a new generation and points CURRENT at it.
+
+        Published generations are never written again, so a restart never
+        loads files from two different checkpoints. Returns its path.
+        """
+        # Index first, then manifest: a crash in between only causes re-embedding
+        persist_started = time.perf_counter()
+        path = new_generation_path(self.index_path)
+        manifest.path = os.path.join(path, MANIFEST_FILENAME)
+        if vector_store is not None:
+            save_compact_store(vector_store, path)
+            lexical_index.save(path)
+        manifest.save()
+        publish_generation(self.index_path, path)
+        INGEST_STAGE_SECONDS.observe(time.perf_counter() - persist_started, stage="persist")
+        print(f"Checkpoint saved ({len(manifest.files)} files tracked).")
+        return path
+
+    def _swap_index(self, vector_store, lexical_index: BM25Index, path: str):
+        """Puts a generation in service. In-flight queries finish on the retriever they already hold."""
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.generation_path = path
+        # The retriever is what requests read, and it is replaced in a single assignment
         self._setup_qa_chain()
 
+    # --- HOT RELOAD ---
+
+    @staticmethod
+    def _data_signature(directory_path: str) -> tuple:
+        """Cheap change check: name, size and mtime of every PDF (no hashing)."""
+        try:
+            with os.scandir(directory_path) as entries:
+                return tuple(sorted((e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in entries if e.name.endswith(".pdf")))
+        except FileNotFoundError:
+            return ()
+
+    def reload_index(self) -> bool:
+        """Ingests what changed in the data directory and swaps the new index in.
+
+        Queries keep being answered from the current index meanwhile.
+        Failures are recorded, not raised.
+        """
+        started = time.perf_counter()
+        try:
+            changed = self.ingest_pdfs(self.data_dir)
+        except Exception as e:
+            print(f"Index reload failed: {e}")
+            INDEX_RELOADS.inc(result="failed")
+            ERRORS.inc(component="ingest", provider=self.provider)
+            self.last_reload = {"at": time.time(), "seconds": round(time.perf_counter() - started, 2), "changed": False, "error": str(e)}
+            return False
+        INDEX_RELOADS.inc(result="changed" if changed else "unchanged")
+        self.last_reload = {"at": time.time(), "seconds": round(time.perf_counter() - started, 2), "changed": changed, "error": None}
+        return changed
+
+    def start_reload(self) -> bool:
+        """Runs reload_index in a background thread. False if not ready yet or already ingesting."""
+        if not self.ready or self._ingest_lock.locked():
+            return False
+        threading.Thread(target=self.reload_index, name="index-reload", daemon=True).start()
+        return True
+
+    def _watch_data_dir(self, interval: float):
+        last_seen = None
+        while not self._stop_watching.wait(interval):
+            seen = self._data_signature(self.data_dir)
+            # Wait until the directory has been still for a whole interval (copies in progress)
+            if seen != self._indexed_signature and seen == last_seen and not self._ingest_lock.locked():
+                print("Data directory changed. Reloading index...")
+                self.reload_index()
+            last_seen = seen
+
+    def start_index_watcher(self, interval: float = INDEX_WATCH_SECONDS):
+        if interval > 0 and self._watcher_thread is None:
+            self._watcher_thread = threading.Thread(target=self._watch_data_dir, args=(interval,), name="index-watcher", daemon=True)
+            self._watcher_thread.start()
+
+    def stop_index_watcher(self):
+        self._stop_watching.set()
+
+    def index_stats(self) -> dict:
+        return {
+            "generation": os.path.basename(self.generation_path) if self.generation_path else None,
+            "chunks": self.vector_store.index.ntotal if self.vector_store is not None else 0,
+            "ingesting": self._ingest_lock.locked(),
+            "watch_seconds": INDEX_WATCH_SECONDS,
+            "last_reload": self.last_reload,
+        }
+
     def _setup_qa_chain(self):
+        from langchain.prompts import PromptTemplate
+
         # Custom Prompt Template
         template = """Sos un Asistente Pedagógico experto en PANTALLAS TÁCTILES.
         Tu misión principal es AYUDAR A LOS DOCENTES A INTEGRAR PANTALLAS TÁCTILES EN SU AULA.
@@ -201,55 +549,55 @@ class RAGService:
         Pregunta: {question}
 
         Respuesta (Pedagógica y útil):"""
-        QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
+        self.qa_prompt = PromptTemplate.from_template(template)
 
         if self.vector_store:
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=self.vector_store.as_retriever(),
-                chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-            )
+            self.retriever = HybridRetriever(vector_store=self.vector_store, lexical_index=self.lexical_index)
+            # Retrieval, context packing and provider choice happen per request (see _prompt_builder)
             print("PDF Ingestion Complete. Vector Store Ready.")
         else:
             print("Vector Store not available. QA Chain skipped.")
+        self.ready = True
+        self.status = "ready"
 
-    def get_answer(self, query: str) -> str:
-        """Retrieves answer from RAG chain (Synchronous)."""
-        if not self.qa_chain:
-            return "No tengo documentos cargados. Por favor, carga los manuales PDF para que pueda asistirte."
-        
-        try:
-            result = self.qa_chain.invoke({"query": query})
-            return result["result"]
-        except Exception as e:
-            return f"Error al generar respuesta: {str(e)}"
+    # --- SHARED HELPERS (sync + async paths) ---
 
-    def stream_answer(self, query: str):
-        """Generates a streaming answer from the RAG chain."""
-        if not self.qa_chain:
-            yield "No tengo documentos cargados. Por favor, carga los manuales PDF para que pueda asistirte."
-            return
+    WARMING_UP_MESSAGE = "Estoy terminando de prepararme (cargando los manuales). Por favor, intentá de nuevo en unos segundos."
+    NO_DOCUMENTS_MESSAGE = "No tengo documentos cargados. Por favor, carga los manuales PDF para que pueda asistirte."
+    BUSY_MESSAGE = "Estoy atendiendo muchas consultas en este momento. Por favor, intentá de nuevo en {seconds} segundos."
 
-        # --- SMART GREETING LOGIC ---
-        query_lower = query.lower().strip()
-        greetings = ["hola", "buenos dias", "buenas tardes", "buenas noches", "qué tal", "como estas"]
-        
-        is_greeting = any(query_lower.startswith(g) for g in greetings) and len(query_lower) < 20
-        
-        if is_greeting:
-            response = "¡Hola! Soy tu Asistente Pedagógico Virtual. Estoy aquí para potenciar tus clases. ¿En qué puedo ayudarte hoy?"
-            for word in response.split():
-                yield word + " "
-                time.sleep(0.05)
-            return
-        
-        try:
-            # Manual RAG for reliable streaming
-            docs = self.vector_store.as_retriever(search_kwargs={"k": 3}).get_relevant_documents(query)
-            context = "\n\n".join([doc.page_content for doc in docs])
-            
-            prompt = f"""Eres un Asistente Pedagógico experto en PANTALLAS TÁCTILES.
+    def _route_intent(self, query: str, query_vector) -> Optional[IntentMatch]:
+        """Greetings, thanks and FAQ questions get their canned answer (no retrieval, no LLM)."""
+        if self.intent_router is None:
+            return None
+        if self.intent_router.needs_reload():
+            self.intent_router.reload()
+        return self._count_intent(self.intent_router.route(query, query_vector))
+
+    async def _aroute_intent(self, query: str, query_vector) -> Optional[IntentMatch]:
+        if self.intent_router is None:
+            return None
+        if self.intent_router.needs_reload():
+            # Re-embeds the examples; keep it off the event loop
+            await asyncio.to_thread(self.intent_router.reload)
+        return self._count_intent(self.intent_router.route(query, query_vector))
+
+    @staticmethod
+    def _count_intent(match: Optional[IntentMatch]) -> Optional[IntentMatch]:
+        if match is not None:
+            INTENT_ROUTES.inc(intent=match.name)
+        return match
+
+    @staticmethod
+    async def _areplay(text: str):
+        """Streams a canned answer word by word (typing effect) without blocking the loop."""
+        for word in re.findall(r"\S+\s*", text):
+            yield word
+            if CANNED_REPLAY_DELAY_MS:
+                await asyncio.sleep(CANNED_REPLAY_DELAY_MS / 1000)
+
+    def _build_stream_prompt(self, context: str, query: str) -> str:
+        return f"""Eres un Asistente Pedagógico experto en PANTALLAS TÁCTILES.
             Tu objetivo es ayudar a los docentes a integrar esta tecnología en sus clases.
             Estás capacitado con manuales y documentos específicos (PDFs/Words) para darte soporte.
             
@@ -265,16 +613,374 @@ class RAGService:
             4. Sé conciso pero completo.
 
             Respuesta:"""
-            
-            # Stream directly from LLM
-            for chunk in self.llm.stream(prompt):
-                if hasattr(chunk, 'content'):
-                    yield chunk.content
+
+    def _build_answer_prompt(self, context: str, query: str) -> str:
+        return self.qa_prompt.format(context=context, question=query)
+
+    def _build_context(self, query: str, docs, provider: str, reserved_tokens: int = 0) -> str:
+        """Dedupes, trims and packs retrieved chunks into the provider's token budget."""
+        builder = self._context_builders.get(provider)
+        if builder is None:
+            builder = self._context_builders[provider] = ContextBuilder.from_env(provider)
+        packed = builder.build(query, docs, reserved_tokens)
+        CONTEXT_TOKENS.observe(packed.tokens + reserved_tokens, provider=provider)
+        if packed.duplicates_dropped:
+            CONTEXT_DUPLICATES.inc(packed.duplicates_dropped, provider=provider)
+        return packed.text
+
+    def _prompt_builder(self, query: str, docs, template, follow_up: Optional[FollowUp] = None):
+        """Returns provider -> prompt for the router. Each provider gets its own
+        context budget; prompts are built on first use (failover, hedging).
+
+        A follow-up's conversation history comes out of the same budget, so
+        it costs no more prompt tokens than a first question.
+        """
+        prompts = {}
+
+        def prompt_for(provider: str) -> str:
+            if provider not in prompts:
+                if follow_up is None:
+                    context = self._build_context(query, docs, provider)
                 else:
-                    yield str(chunk)
-                
+                    context = self._build_context(follow_up.query, docs, provider, follow_up.tokens)
+                    context = f"{context}\n\nConversación previa con el docente:\n{follow_up.history}"
+                prompts[provider] = template(context, query)
+            return prompts[provider]
+
+        # Build the likely pick now, so the "prompt" stage covers it
+        prompt_for(self.router.ranked()[0])
+        return prompt_for
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        if hasattr(chunk, 'content'):
+            return chunk.content
+        return str(chunk)
+
+    def _remember(self, users, query: str, answer: str, follow_up: Optional[FollowUp]):
+        """Adds the turn to each user's conversation (with the query retrieval used)."""
+        retrieval_query = follow_up.query if follow_up is not None else query
+        for user in dict.fromkeys(users):
+            self.conversations.record(user, query, answer, retrieval_query)
+
+    def _llm_scheduler(self, provider: str) -> FairScheduler:
+        """Bounds in-flight and queued LLM calls per provider (async path only)."""
+        scheduler = self._llm_schedulers.get(provider)
+        if scheduler is None:
+            scheduler = self._llm_schedulers[provider] = FairScheduler.from_env(provider)
+        return scheduler
+
+    async def aadmit(self, query: str, user=None, coalesce: bool = False) -> Optional[int]:
+        """Early admission check for a question.
+
+        Returns None when it will not need an LLM slot (not ready, canned
+        intent, cached answer, or joining an identical stream already
+        running with `coalesce`), else the queue position it would get.
+        Raises SchedulerBusy when every provider's queue is full.
+        """
+        if not self.ready or not self.retriever or self.router is None:
+            return None
+        # The answer path embeds the same query again; that hits the embedder's cache
+        try:
+            query_vector = await self.query_embedder.aembed_query(query)
+        except Exception as e:
+            # Let it through: the answer path hits the same error and reports it as usual
+            print(f"Admission check could not embed the question: {e}")
+            return None
+        if self.intent_router is not None and self.intent_router.route(query, query_vector) is not None:
+            return None
+        # The answer path resolves (and counts) the follow-up itself
+        if not await self.conversations.ais_follow_up(user, query):
+            if self.answer_cache.contains(query_vector):
+                return None
+            if coalesce and STREAM_COALESCING and self.coalescer.joinable((self.provider, normalize(query))):
+                return None
+        return self.router.admit(user)
+
+    def scheduler_stats(self) -> dict:
+        return {provider: scheduler.stats() for provider, scheduler in self._llm_schedulers.items()}
+
+    # --- SYNCHRONOUS API (scripts, tools) ---
+
+    def get_answer(self, query: str, user=None) -> str:
+        """Retrieves answer from RAG chain (Synchronous).
+
+        `user` keys the conversation that follow-up questions are answered in.
+        """
+        trace = RequestTrace(self.provider, "answer")
+        if not self.ready:
+            trace.finish("not_ready")
+            return self.WARMING_UP_MESSAGE
+        if not self.retriever:
+            trace.finish("no_documents")
+            return self.NO_DOCUMENTS_MESSAGE
+        
+        try:
+            with trace.stage("embed"):
+                query_vector = self.query_embedder.embed_query(query)
+            intent = self._route_intent(query, query_vector)
+            if intent is not None:
+                trace.finish("intent")
+                return intent.answer
+            follow_up = self.conversations.follow_up(user, query)
+            if follow_up is None:
+                cached = self.answer_cache.lookup(query_vector)
+                if cached is not None:
+                    self._remember([user], query, cached, None)
+                    trace.finish("cache_hit")
+                    return cached
+            else:
+                with trace.stage("rewrite"):
+                    query_vector = self.query_embedder.embed_query(follow_up.query)
+
+            # An index swap during this answer keeps it out of the cache
+            cache_generation = self.answer_cache.generation
+            with trace.stage("retrieve"):
+                docs = self.retriever.retrieve(follow_up.query if follow_up else query, query_vector, k=CONTEXT_CANDIDATES)
+            with trace.stage("prompt"):
+                prompt_for = self._prompt_builder(query, docs, self._build_answer_prompt, follow_up)
+            answer_parts = []
+            with trace.stage("llm"):
+                for provider, chunk in self.router.stream(prompt_for):
+                    trace.provider = provider
+                    answer_parts.append(self._chunk_text(chunk))
+            answer = "".join(answer_parts)
+            if follow_up is None:
+                # A follow-up's answer depends on its conversation: nobody else can reuse it
+                self.answer_cache.store(query, query_vector, answer, cache_generation)
+            self._remember([user], query, answer, follow_up)
+            trace.finish("llm")
+            return answer
+        except Exception as e:
+            trace.finish("error")
+            return f"Error al generar respuesta: {str(e)}"
+
+    def stream_answer(self, query: str, user=None):
+        """Generates a streaming answer from the RAG chain, in `user`'s conversation."""
+        trace = RequestTrace(self.provider, "stream")
+        if not self.ready:
+            trace.finish("not_ready")
+            yield self.WARMING_UP_MESSAGE
+            return
+        if not self.retriever:
+            trace.finish("no_documents")
+            yield self.NO_DOCUMENTS_MESSAGE
+            return
+
+        try:
+            # Embed once: the same vector is used for routing, the cache lookup and retrieval
+            with trace.stage("embed"):
+                query_vector = self.query_embedder.embed_query(query)
+
+            # --- INTENT ROUTING ---
+            intent = self._route_intent(query, query_vector)
+            if intent is not None:
+                trace.finish("intent")
+                yield intent.answer
+                return
+
+            # --- CONVERSATION ---
+            # Follow-ups ("¿y en Windows?") get the conversation so far and a query with its topic
+            follow_up = self.conversations.follow_up(user, query)
+            if follow_up is None:
+                cached = self.answer_cache.lookup(query_vector)
+                if cached is not None:
+                    self._remember([user], query, cached, None)
+                    trace.finish("cache_hit")
+                    yield cached
+                    return
+            else:
+                with trace.stage("rewrite"):
+                    query_vector = self.query_embedder.embed_query(follow_up.query)
+
+            # Manual RAG for reliable streaming
+            # An index swap during this answer keeps it out of the cache
+            cache_generation = self.answer_cache.generation
+            with trace.stage("retrieve"):
+                docs = self.retriever.retrieve(follow_up.query if follow_up else query, query_vector, k=CONTEXT_CANDIDATES)
+            with trace.stage("prompt"):
+                prompt_for = self._prompt_builder(query, docs, self._build_stream_prompt, follow_up)
+            
+            # Stream directly from the fastest healthy provider
+            answer_parts = []
+            trace.start_generation()
+            for provider, chunk in self.router.stream(prompt_for):
+                trace.provider = provider
+                trace.on_chunk(chunk)
+                text = self._chunk_text(chunk)
+                answer_parts.append(text)
+                yield text
+            trace.end_generation()
+
+            # Only complete answers reach this point (a disconnect closes the generator)
+            answer = "".join(answer_parts)
+            if follow_up is None:
+                self.answer_cache.store(query, query_vector, answer, cache_generation)
+            self._remember([user], query, answer, follow_up)
+            trace.finish("llm")
+
+        except GeneratorExit:
+            trace.finish("cancelled")
+            raise
+        except Exception as e:
+            trace.finish("error")
+            yield ErrorText(f"Error generating stream: {str(e)}")
+
+    # --- ASYNCHRONOUS API (FastAPI endpoints) ---
+    # Embedding and retrieval run in the default executor, LLM calls use the
+    # provider's native ainvoke/astream, so no request ever blocks the event loop.
+
+    async def aget_answer(self, query: str, user=None) -> str:
+        """Retrieves answer from RAG chain without blocking the event loop.
+
+        `user` is the requester's lane in the provider's fair queue, and
+        keys the conversation that follow-up questions are answered in.
+        """
+        trace = RequestTrace(self.provider, "answer")
+        if not self.ready:
+            trace.finish("not_ready")
+            return self.WARMING_UP_MESSAGE
+        if not self.retriever:
+            trace.finish("no_documents")
+            return self.NO_DOCUMENTS_MESSAGE
+
+        try:
+            with trace.stage("embed"):
+                query_vector = await self.query_embedder.aembed_query(query)
+            intent = await self._aroute_intent(query, query_vector)
+            if intent is not None:
+                trace.finish("intent")
+                return intent.answer
+            follow_up = await self.conversations.afollow_up(user, query)
+            if follow_up is None:
+                cached = self.answer_cache.lookup(query_vector)
+                if cached is not None:
+                    self._remember([user], query, cached, None)
+                    trace.finish("cache_hit")
+                    return cached
+            else:
+                with trace.stage("rewrite"):
+                    query_vector = await self.query_embedder.aembed_query(follow_up.query)
+
+            # An index swap during this answer keeps it out of the cache
+            cache_generation = self.answer_cache.generation
+            with trace.stage("retrieve"):
+                docs = await asyncio.to_thread(self.retriever.retrieve, follow_up.query if follow_up else query, query_vector, CONTEXT_CANDIDATES)
+            with trace.stage("prompt"):
+                prompt_for = self._prompt_builder(query, docs, self._build_answer_prompt, follow_up)
+
+            # The router waits for a slot in the provider's fair queue, fails over and hedges
+            answer_parts = []
+            with trace.stage("llm"):
+                async with aclosing(self.router.astream(prompt_for, user)) as chunks:
+                    async for provider, chunk in chunks:
+                        trace.provider = provider
+                        answer_parts.append(self._chunk_text(chunk))
+            answer = "".join(answer_parts)
+            if follow_up is None:
+                self.answer_cache.store(query, query_vector, answer, cache_generation)
+            self._remember([user], query, answer, follow_up)
+            trace.finish("llm")
+            return answer
+        except SchedulerBusy as e:
+            trace.finish("busy")
+            return self.BUSY_MESSAGE.format(seconds=e.retry_after)
+        except Exception as e:
+            trace.finish("error")
+            return f"Error al generar respuesta: {str(e)}"
+
+    async def astream_answer(self, query: str, user=None):
+        """Async generator version of stream_answer for StreamingResponse.
+
+        When a whole class sends the same question at once, one generation
+        runs and its chunks fan out to every request (see StreamCoalescer).
+        Follow-ups of a live conversation are answered from the asker's own
+        history, so they are never shared.
+        """
+        # Cheap unless the wording is a follow-up cue and the user has a conversation
+        follow_up = await self.conversations.afollow_up(user, query)
+        if not STREAM_COALESCING or follow_up is not None:
+            async with aclosing(self._astream_answer(query, user, follow_up)) as chunks:
+                async for text in chunks:
+                    yield text
+            return
+        key = (self.provider, normalize(query))
+        # The first requester's queue lane is used for the shared generation;
+        # the answer goes into the conversation of everyone who got it
+        shared = self.coalescer.stream(key, lambda members: self._astream_answer(query, user, None, members), member=user)
+        async with aclosing(shared) as chunks:
+            async for text in chunks:
+                yield text
+
+    async def _astream_answer(self, query: str, user=None, follow_up: Optional[FollowUp] = None, members=None):
+        trace = RequestTrace(self.provider, "stream")
+        if not self.ready:
+            trace.finish("not_ready")
+            yield self.WARMING_UP_MESSAGE
+            return
+        if not self.retriever:
+            trace.finish("no_documents")
+            yield self.NO_DOCUMENTS_MESSAGE
+            return
+
+        try:
+            with trace.stage("embed"):
+                query_vector = await self.query_embedder.aembed_query(query)
+
+            intent = await self._aroute_intent(query, query_vector)
+            if intent is not None:
+                trace.finish("intent")
+                async for word in self._areplay(intent.answer):
+                    yield word
+                return
+            users = members if members is not None else [user]
+            if follow_up is None:
+                cached = self.answer_cache.lookup(query_vector)
+                if cached is not None:
+                    self._remember(users, query, cached, None)
+                    trace.finish("cache_hit")
+                    yield cached
+                    return
+            else:
+                with trace.stage("rewrite"):
+                    query_vector = await self.query_embedder.aembed_query(follow_up.query)
+
+            # An index swap during this answer keeps it out of the cache
+            cache_generation = self.answer_cache.generation
+            with trace.stage("retrieve"):
+                docs = await asyncio.to_thread(self.retriever.retrieve, follow_up.query if follow_up else query, query_vector, CONTEXT_CANDIDATES)
+            with trace.stage("prompt"):
+                prompt_for = self._prompt_builder(query, docs, self._build_stream_prompt, follow_up)
+
+            # TTFT includes waiting for the provider's concurrency slot
+            answer_parts = []
+            trace.start_generation()
+            async with aclosing(self.router.astream(prompt_for, user)) as chunks:
+                async for provider, chunk in chunks:
+                    trace.provider = provider
+                    trace.on_chunk(chunk)
+                    text = self._chunk_text(chunk)
+                    answer_parts.append(text)
+                    yield text
+            trace.end_generation()
+
+            answer = "".join(answer_parts)
+            if follow_up is None:
+                self.answer_cache.store(query, query_vector, answer, cache_generation)
+            self._remember(users, query, answer, follow_up)
+            trace.finish("llm")
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # Client gone (or, when coalesced, every client gone)
+            trace.finish("cancelled")
+            raise
+        except SchedulerBusy as e:
+            # Only when the queue filled up after admission (see aadmit)
+            trace.finish("busy")
+            yield self.BUSY_MESSAGE.format(seconds=e.retry_after)
         except Exception as e:
-            yield f"Error generating stream: {str(e)}"
+            trace.finish("error")
+            yield ErrorText(f"Error generating stream: {str(e)}")
 
 # Singleton usage
 rag_service = RAGService()
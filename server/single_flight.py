@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+from metrics import COALESCED_STREAMS
+
+
+class _Flight:
+    """One in-flight generation: an append-only chunk log plus a wake-up event."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.members: List[Hashable] = []  # who is listening (see StreamCoalescer.stream)
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: Optional[str] = None):
+        if chunk is not None:
+            self.chunks.append(chunk)
+        # Wake everyone waiting on the current event, then arm a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class StreamCoalescer:
+    """Shares one generation between identical concurrent stream requests.
+
+    The first request for a key starts the producer as a task; later ones
+    attach to it. Chunks go to a shared log that every subscriber reads with
+    its own cursor, so late joiners first get the prefix already emitted and
+    a slow client never holds up the producer or the other clients. If every
+    subscriber leaves before the end, the producer is cancelled.
+
+    `factory(members)` receives the live list of the subscribers' `member`
+    tags, so the producer can credit each of them with the result.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def joinable(self, key: Hashable) -> bool:
+        """Whether stream(key) would attach to a running generation."""
+        return key in self._flights
+
+    async def _produce(self, key: Hashable, flight: _Flight, factory: Callable[[List[Hashable]], AsyncIterator[str]]):
+        try:
+            async with aclosing(factory(flight.members)) as chunks:
+                async for chunk in chunks:
+                    flight.publish(chunk)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.publish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def stream(self, key: Hashable, factory: Callable[[List[Hashable]], AsyncIterator[str]], member: Hashable = None):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, factory))
+        else:
+            COALESCED_STREAMS.inc()
+        flight.subscribers += 1
+        flight.members.append(member)
+
+        cursor = 0
+        try:
+            while True:
+                if cursor < len(flight.chunks):
+                    # Whatever accumulated since the last read goes out as one write
+                    pending = flight.chunks[cursor:]
+                    cursor += len(pending)
+                    if all(type(chunk) is str for chunk in pending):
+                        yield "".join(pending)
+                    else:
+                        # Marked chunks (e.g. ErrorText) keep their type
+                        for chunk in pending:
+                            yield chunk
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if not flight.done:
+                # Left before the end: did not get the result
+                flight.members.remove(member)
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening anymore: stop generating
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
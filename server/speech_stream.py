@@ -0,0 +1,105 @@
+import re
+import asyncio
+from contextlib import suppress
+from typing import AsyncIterator, Callable, List, Optional
+
+from stream_transport import ErrorText
+
+# A sentence ends at . ! ? … or : followed by whitespace, or at a line break
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…:])\s+|\n+")
+_MARKDOWN_RE = re.compile(r"[*_#`>|]+")
+_BULLET_RE = re.compile(r"^\s*(?:[-•]|\d+[.)])\s+", re.MULTILINE)
+
+
+def clean_for_speech(text: str) -> str:
+    """Strips the Markdown the LLM uses for formatting so it is not read aloud."""
+    text = _BULLET_RE.sub("", text)
+    text = _MARKDOWN_RE.sub("", text)
+    return " ".join(text.split())
+
+
+class SentenceSplitter:
+    """Turns a token stream into sentences as soon as they are complete.
+
+    Very short fragments ("1.", "Hola.") are merged into the next sentence
+    so each synthesis call carries a useful amount of speech.
+    """
+
+    def __init__(self, min_chars: int = 25):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(self._buffer):
+            candidate = self._buffer[start:match.start()]
+            if len(clean_for_speech(candidate)) >= self.min_chars:
+                sentences.append(clean_for_speech(candidate))
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        rest = clean_for_speech(self._buffer)
+        self._buffer = ""
+        return rest or None
+
+
+async def stream_speech(
+    token_stream: AsyncIterator[str],
+    synthesize: Callable[[str], Optional[bytes]],
+    executor,
+    max_pending: int = 4,
+) -> AsyncIterator[tuple]:
+    """Yields (sentence, audio_bytes) in order while the answer is still streaming.
+
+    Sentences are synthesized concurrently on `executor`. At most
+    `max_pending` syntheses run ahead of the consumer, so a slow client
+    does not make the producer buffer the whole answer. Error chunks
+    (ErrorText) are not read aloud.
+    """
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    splitter = SentenceSplitter()
+
+    async def produce():
+        try:
+            async for token in token_stream:
+                if isinstance(token, ErrorText):
+                    continue
+                for sentence in splitter.feed(token):
+                    await pending.put((sentence, loop.run_in_executor(executor, synthesize, sentence)))
+            rest = splitter.flush()
+            if rest:
+                await pending.put((rest, loop.run_in_executor(executor, synthesize, rest)))
+        except Exception as e:
+            await pending.put(e)
+            return
+        await pending.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            sentence, future = item
+            audio = await future
+            if audio:
+                yield sentence, audio
+    finally:
+        # Client went away (or we are done): stop pulling tokens from the LLM
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
+        # Releases the provider attempt and its queue slot now, not when the generator is collected
+        await token_stream.aclose()
+        # Syntheses queued but never awaited; ones already running on the executor finish on their own
+        while not pending.empty():
+            item = pending.get_nowait()
+            if isinstance(item, tuple):
+                item[1].cancel()
@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+
+from metrics import STREAM_WRITES, STREAM_CHUNKS, STREAM_DISCONNECTS
+
+# After the first chunk, hold writes this long to batch the tokens that follow
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "50"))
+# ...unless this many characters are already waiting
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "512"))
+# SSE heartbeat while the LLM is silent (prompt evaluation on a CPU can take a while)
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# How often to ask the server whether the client is still there
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "1"))
+
+HEARTBEAT = None  # yielded by batched_stream when a heartbeat is due
+
+
+class ErrorText(str):
+    """A chunk that reports a failure instead of answer text.
+
+    Text transports send it like any other chunk; speech skips it.
+    """
+
+
+class _Reader:
+    """Drains the answer generator in its own task into a buffer.
+
+    The generator never waits on the socket: a slow client just gets bigger
+    writes. Cancelling the task cancels the generation behind it.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        self.buffer = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._wake = asyncio.Event()
+        self.task = asyncio.create_task(self._run(chunks))
+
+    async def _run(self, chunks):
+        try:
+            async with aclosing(chunks) as source:
+                async for chunk in source:
+                    if chunk:
+                        self.buffer.append(chunk)
+                        self.size += len(chunk)
+                        self._wake.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake.set()
+
+    async def wait(self, timeout: float):
+        """Waits (at most `timeout`) for the next chunk or the end."""
+        self._wake.clear()
+        try:
+            async with asyncio.timeout(max(timeout, 0.0)):
+                await self._wake.wait()
+        except TimeoutError:
+            pass
+
+    def take(self) -> str:
+        text = "".join(self.buffer)
+        STREAM_CHUNKS.inc(len(self.buffer))
+        self.buffer = []
+        self.size = 0
+        return text
+
+
+async def batched_stream(
+    request: Request,
+    chunks: AsyncIterator[str],
+    flush_seconds: float = STREAM_FLUSH_MS / 1000,
+    flush_chars: int = STREAM_FLUSH_CHARS,
+    heartbeat_seconds: float = 0.0,
+    poll_seconds: float = DISCONNECT_POLL_SECONDS,
+):
+    """Yields the answer in batches and stops the generation if the client leaves.
+
+    The first chunk goes out immediately (time to first token); later ones
+    are held up to `flush_seconds` or `flush_chars` so a fast model does not
+    turn every token into a socket write. Yields HEARTBEAT after
+    `heartbeat_seconds` without output, if set.
+    """
+    reader = _Reader(chunks)
+    first = True
+    last_write = last_poll = time.monotonic()
+    try:
+        while True:
+            if not reader.buffer and not reader.done:
+                waits = [poll_seconds]
+                if heartbeat_seconds:
+                    waits.append(last_write + heartbeat_seconds - time.monotonic())
+                await reader.wait(min(waits))
+
+            if reader.buffer:
+                if not first:
+                    deadline = time.monotonic() + flush_seconds
+                    while not reader.done and reader.size < flush_chars and time.monotonic() < deadline:
+                        await reader.wait(deadline - time.monotonic())
+                first = False
+                yield reader.take()
+                last_write = time.monotonic()
+            elif reader.done:
+                if reader.error is not None:
+                    raise reader.error
+                return
+            elif heartbeat_seconds and time.monotonic() - last_write >= heartbeat_seconds:
+                yield HEARTBEAT
+                last_write = time.monotonic()
+
+            # Disconnects otherwise only surface on the next write, which may be many seconds away
+            if time.monotonic() - last_poll >= poll_seconds:
+                last_poll = time.monotonic()
+                if await request.is_disconnected():
+                    STREAM_DISCONNECTS.inc()
+                    return
+    finally:
+        reader.task.cancel()
+
+
+async def text_stream(request: Request, chunks: AsyncIterator[str]):
+    """Plain text body (the default /api/chat/stream format)."""
+    async for text in batched_stream(request, chunks):
+        STREAM_WRITES.inc(format="text")
+        yield text
+
+
+def _sse_event(event: str, data: str = "") -> str:
+    # Multi-line data goes out as one "data:" line per line; clients join them with \n
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
+
+
+async def sse_stream(request: Request, chunks: AsyncIterator[str], heartbeat_seconds: float = SSE_HEARTBEAT_SECONDS):
+    """Server-Sent Events: "token" events, "heartbeat" while waiting, "done" at the end."""
+    async for text in batched_stream(request, chunks, heartbeat_seconds=heartbeat_seconds):
+        STREAM_WRITES.inc(format="sse")
+        yield _sse_event("heartbeat") if text is HEARTBEAT else _sse_event("token", text)
+    yield _sse_event("done")
@@ -0,0 +1,42 @@
+import pytest
+
+from conversation_memory import ConversationMemory, is_follow_up
+
+
+@pytest.mark.parametrize("question", [
+    "¿Cómo calibro la pantalla?",
+    "¿Qué es una pantalla táctil?",
+    "¿Qué es lo más importante al usar la pantalla en primer grado?",
+    "Lo que necesito es una actividad para sumar",
+    "¿Cómo paso de una aplicación a otra?",
+    "¿Cómo conecto el proyector a otra computadora?",
+])
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "¿y en Windows?",
+    "¿cómo lo hago?",
+    "¿Lo puedo usar con tablets?",
+    "dame otro ejemplo",
+    "¿Hay otra forma?",
+    "¿tenés otro?",
+    "¿eso sirve para primaria?",
+    "¿se puede hacer lo mismo en la tablet?",
+    "¿por qué?",
+])
+def test_follow_up_questions(question):
+    assert is_follow_up(question)
+
+
+def test_standalone_question_skips_history():
+    memory = ConversationMemory()
+    memory.record(1, "¿Cómo calibro la pantalla?", "Desde el menú de ajustes.", "calibro pantalla")
+    assert memory.follow_up(1, "¿Qué es lo más importante al usar la pantalla en primer grado?") is None
+    follow_up = memory.follow_up(1, "¿y en Windows?")
+    assert follow_up is not None and "calibro" in follow_up.query
+
+
+def test_follow_up_needs_a_conversation():
+    assert ConversationMemory().follow_up(1, "dame otro ejemplo") is None
@@ -0,0 +1,139 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def audio_cache_key(text: str, lang: str, slow: bool, tld: str) -> str:
+    """Content address of a clip: same text + voice settings -> same MP3."""
+    raw = "\0".join([text, lang, "slow" if slow else "normal", tld])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Two-tier cache for synthesized MP3 clips.
+
+    Hot clips live in an in-memory LRU bounded by total bytes. Every clip is
+    also written to disk as <key>.mp3; the disk tier is bounded by size and
+    evicts the least recently used files (access time is tracked via mtime).
+    Disk hits are read into memory, so an eviction never pulls a file out
+    from under a response that is being sent.
+    """
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Clips kept from previous runs count against the disk cap
+        self._disk_size = self._scan_disk_size()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            directory=os.getenv("TTS_CACHE_DIR", "tts_cache"),
+            memory_bytes=int(float(os.getenv("TTS_CACHE_MEMORY_MB", "32")) * 1024 * 1024),
+            disk_bytes=int(float(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024),
+        )
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get_memory(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return data
+
+    def get_disk(self, key: str) -> Optional[bytes]:
+        """Reads the clip from disk (refreshing its LRU position and promoting it to memory), or None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Never written, or evicted since
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> str:
+        self._remember(key, data)
+
+        path = self.path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            # Replacing under the lock keeps the size of an overwritten clip exact
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._disk_size += len(data) - replaced
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+        return path
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _scan_disk_size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".mp3"))
+
+    def _evict_disk(self):
+        # Called with the lock held. Trim to 90% of the cap to avoid evicting on every write.
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".mp3")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        target = int(self.disk_bytes * 0.9)
+        for entry in entries:
+            if self._disk_size <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_size -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_bytes": self._disk_size,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -1,5 +1,11 @@
 from gtts import gTTS
 import io
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from tts_cache import AudioCache, audio_cache_key
+from metrics import TTS_SECONDS, TTS_SYNTHESIS_SECONDS, ERRORS
 
 class TTSService:
     _instance = None
@@ -13,25 +19,98 @@ class TTSService:
     def _initialize(self):
         print("-------- TTS SERVICE INITIALIZING (Google TTS) --------")
         # gTTS doesn't need model loading
-        pass
+        # Voice settings (part of the cache key)
+        self.lang = os.getenv("TTS_LANG", "es")
+        self.tld = os.getenv("TTS_TLD", "com")
+        self.slow = False
 
-    def generate_audio(self, text: str):
-        """Generates audio bytes (MP3) from text using gTTS."""
-        try:
-            # Create gTTS object
-            # lang='es' for Spanish
-            tts = gTTS(text=text, lang='es', slow=False)
-            
-            # Save to BytesIO buffer
-            buffer = io.BytesIO()
-            tts.write_to_fp(buffer)
-            buffer.seek(0)
-            
-            return buffer
+        # --- AUDIO CACHE (memory LRU + disk) ---
+        # The frontend reads the same greetings/cached answers aloud again and again
+        self.cache = AudioCache.from_env()
+        # Clips being synthesized right now: key -> Future with the bytes (None on failure)
+        self._synthesizing = {}
+        self._synthesizing_lock = threading.Lock()
+
+        # Bounded pool for sentence-by-sentence synthesis while an answer streams
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("TTS_STREAM_WORKERS", "3")),
+            thread_name_prefix="tts",
+        )
+
+    def synthesize(self, text: str) -> bytes:
+        """Calls gTTS and returns the MP3 bytes (no caching)."""
+        tts = gTTS(text=text, lang=self.lang, tld=self.tld, slow=self.slow)
+        buffer = io.BytesIO()
+        tts.write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def get_clip(self, text: str):
+        """Returns (key, data) for the clip, synthesizing it on a cache miss.
+
+        Concurrent misses for the same clip share one synthesis.
+        Returns None if synthesis fails.
+        """
+        started = time.perf_counter()
+        key = audio_cache_key(text, self.lang, self.slow, self.tld)
+
+        data = self.cache.get_memory(key)
+        if data is not None:
+            TTS_SECONDS.observe(time.perf_counter() - started, result="memory_hit")
+            return key, data
+
+        data = self.cache.get_disk(key)
+        if data is not None:
+            TTS_SECONDS.observe(time.perf_counter() - started, result="disk_hit")
+            return key, data
 
+        with self._synthesizing_lock:
+            flight = self._synthesizing.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._synthesizing[key] = Future()
+        if not leader:
+            # Someone is already synthesizing this clip: wait for theirs
+            data = flight.result()
+            TTS_SECONDS.observe(time.perf_counter() - started, result="coalesced" if data else "error")
+            return (key, data) if data else None
+
+        data = None
+        try:
+            synthesis_started = time.perf_counter()
+            data = self.synthesize(text)
+            TTS_SYNTHESIS_SECONDS.observe(time.perf_counter() - synthesis_started)
+            self.cache.put(key, data)
         except Exception as e:
             print(f"Error generating audio with gTTS: {e}")
+            ERRORS.inc(component="tts")
+        finally:
+            with self._synthesizing_lock:
+                del self._synthesizing[key]
+            flight.set_result(data)
+        if not data:
+            TTS_SECONDS.observe(time.perf_counter() - started, result="error")
+            return None
+        TTS_SECONDS.observe(time.perf_counter() - started, result="synthesized")
+        return key, data
+
+    def get_cached_clip(self, key: str):
+        """Looks up a clip by its content key without synthesizing (None if evicted)."""
+        data = self.cache.get_memory(key)
+        if data is None:
+            data = self.cache.get_disk(key)
+        return (key, data) if data is not None else None
+
+    def get_clip_bytes(self, text: str):
+        """Cached MP3 bytes for one sentence (None on failure). Used by the speech stream."""
+        clip = self.get_clip(text)
+        return clip[1] if clip is not None else None
+
+    def generate_audio(self, text: str):
+        """MP3 for `text` as a file-like object, through the cache."""
+        data = self.get_clip_bytes(text)
+        if data is None:
             return None
+        return io.BytesIO(data)
 
 # Singleton usage
 tts_service = TTSService()